@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the Inventory Service
+
+Benchmarks run against the database in DATABASE_URI and drop and recreate
+the inventory table, so never point them at a database you care about.
+"""
@@ -0,0 +1,86 @@
+"""
+Contention benchmark for increasing the stock of one Inventory
+
+Runs many threads that all increase the stock of the same Inventory, first
+with the old read-modify-write path (find_by_id, quantity += n, update) and
+then with Inventory.increase_stock, and reports throughput and lost updates.
+
+Run it with:
+    python -m benchmarks.increase_contention --threads 16 --increments 200
+"""
+import argparse
+import logging
+import threading
+import time
+
+from service import app
+from service.models import Inventory, Condition, db
+
+
+def read_modify_write(inv_id: int):
+    """The increase path used by AddStockResource before increase_stock"""
+    inv = Inventory.find_by_id(inv_id)
+    inv.quantity += 1
+    inv.update()
+
+
+def atomic_increase(inv_id: int):
+    """The single statement increase path"""
+    Inventory.increase_stock(inv_id, 1)
+
+
+def run(increase, threads: int, increments: int) -> dict:
+    """Hammers one Inventory from many threads and checks the final quantity"""
+    inv = Inventory(name="hot-sku", condition=Condition.new, quantity=0, restock_level=0)
+    inv.create()
+    inv_id = inv.id
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(increments):
+                increase(inv_id)
+            db.session.remove()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    db.session.expire_all()
+    expected = threads * increments
+    actual = Inventory.find_by_id(inv_id).quantity
+    return {
+        "path": increase.__name__,
+        "increments": expected,
+        "lost_updates": expected - actual,
+        "seconds": round(elapsed, 3),
+        "increments_per_sec": round(expected / elapsed, 1),
+    }
+
+
+def main():
+    """Runs both increase paths and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--increments", type=int, default=200,
+        help="increments issued by every thread")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    db.drop_all()
+    db.create_all()
+    for increase in (read_modify_write, atomic_increase):
+        result = run(increase, args.threads, args.increments)
+        print("{path:<18} {increments_per_sec:>10} inc/s  lost updates: {lost_updates} of {increments}".format(**result))
+    db.session.remove()
+    db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
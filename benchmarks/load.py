@@ -0,0 +1,294 @@
+"""
+End-to-end HTTP load generator for the Inventory Service
+
+Starts service:app under gunicorn with the given workers, threads and worker
+class, seeds it through the bulk endpoint and then drives one or more named
+workload profiles from many keep-alive client threads. Throughput and the
+p50/p95/p99/p999 latency of every endpoint are printed and written as JSON.
+
+profiles:
+    catalog  read-heavy browsing: single lookups and list pages
+    hot-sku  every client increases the stock of the same Inventory
+    listing  filtered lists and statistics
+    crud     creates, reads, updates and deletes of the clients' own Inventory
+
+The service uses DATABASE_URI as usual and the seeded rows are left behind,
+so point it at a local database:
+    python -m benchmarks.load --workers 2 --threads 8 --clients 32 --duration 30
+    python -m benchmarks.load --profile hot-sku --worker-class sync --threads 1
+    python -m benchmarks.load --url http://localhost:8080 --profile catalog
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+NAMES = ["chocolate", "noodle", "fan", "computer", "speaker", "pencil"]
+CONDITIONS = ["new", "used", "slightly_used", "unknown"]
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))
+
+
+def fake_inventory(rng: random.Random) -> dict:
+    """Returns the body of a random Inventory"""
+    quantity = rng.randint(0, 1000)
+    return {
+        "name": rng.choice(NAMES),
+        "condition": rng.choice(CONDITIONS),
+        "quantity": quantity,
+        "restock_level": rng.randint(0, quantity),
+    }
+
+
+class Client:
+    """One keep-alive connection that records the latency of every request"""
+
+    def __init__(self, host: str, port: int, seed: int):
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.created = []  # ids of the Inventory this client created
+
+    def request(self, endpoint: str, method: str, path: str, body=None):
+        """Sends a request and returns its decoded JSON body, or None"""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return json.loads(data) if data else None
+
+
+######################################################################
+#  W O R K L O A D   P R O F I L E S
+######################################################################
+
+def catalog(client: Client, seeded: dict):
+    """Browses single Inventory and list pages"""
+    inv_id = client.rng.choice(seeded["ids"])
+    if client.rng.random() < 0.8:
+        client.request("GET /inventory/{id}", "GET", "/api/inventory/{}".format(inv_id))
+    else:
+        client.request("GET /inventory?limit", "GET", "/api/inventory?limit=50&after_id={}".format(inv_id))
+
+
+def hot_sku(client: Client, seeded: dict):
+    """Increases the stock of one Inventory and now and then reads it back"""
+    path = "/api/inventory/{}".format(seeded["hot_id"])
+    if client.rng.random() < 0.9:
+        client.request("PUT /inventory/{id}/increase", "PUT", path + "/increase", {"add_stock": 1})
+    else:
+        client.request("GET /inventory/{id}", "GET", path)
+
+
+def listing(client: Client, seeded: dict):
+    """Lists Inventory by filters and asks for their statistics"""
+    name, condition = client.rng.choice(NAMES), client.rng.choice(CONDITIONS)
+    roll = client.rng.random()
+    if roll < 0.5:
+        client.request("GET /inventory?filters&limit", "GET",
+            "/api/inventory?name={}&condition={}&limit=100".format(name, condition))
+    elif roll < 0.8:
+        client.request("GET /inventory?need_restock&limit", "GET",
+            "/api/inventory?need_restock=true&limit=100")
+    else:
+        client.request("GET /inventory/stats", "GET", "/api/inventory/stats?condition={}".format(condition))
+
+
+def crud(client: Client, seeded: dict):
+    """Creates, reads, updates and deletes the Inventory of this client"""
+    roll = client.rng.random()
+    if roll < 0.3 or not client.created:
+        data = client.request("POST /inventory", "POST", "/api/inventory", fake_inventory(client.rng))
+        if data:
+            client.created.append(data["id"])
+    elif roll < 0.6:
+        client.request("GET /inventory/{id}", "GET", "/api/inventory/{}".format(client.rng.choice(client.created)))
+    elif roll < 0.8:
+        client.request("PUT /inventory/{id}", "PUT",
+            "/api/inventory/{}".format(client.rng.choice(client.created)), fake_inventory(client.rng))
+    elif roll < 0.9:
+        inv_id = client.created.pop(client.rng.randrange(len(client.created)))
+        client.request("DELETE /inventory/{id}", "DELETE", "/api/inventory/{}".format(inv_id))
+    else:
+        client.request("GET /inventory?limit", "GET", "/api/inventory?limit=50")
+
+
+PROFILES = {"catalog": catalog, "hot-sku": hot_sku, "listing": listing, "crud": crud}
+
+
+######################################################################
+#  R U N N E R
+######################################################################
+
+def start_server(args) -> subprocess.Popen:
+    """Starts service:app under gunicorn and waits until it answers"""
+    env = dict(os.environ,
+        PORT=str(args.port),
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_WORKER_CLASS=args.worker_class,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config=gunicorn.conf.py", "--log-level=warning", "service:app"],
+        env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit("gunicorn exited with {}".format(server.returncode))
+        try:
+            connection = http.client.HTTPConnection("localhost", args.port, timeout=1)
+            connection.request("GET", "/api/internal/pool")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    sys.exit("gunicorn did not answer on port {}".format(args.port))
+
+
+def seed(host: str, port: int, rows: int) -> dict:
+    """Creates rows Inventory plus the hot SKU and returns their ids"""
+    client = Client(host, port, 0)
+    ids = []
+    for start in range(0, rows, 1000):
+        body = [fake_inventory(client.rng) for _ in range(min(1000, rows - start))]
+        data = client.request("POST /inventory/bulk", "POST", "/api/inventory/bulk", body)
+        if data is None:
+            sys.exit("Seeding failed")
+        ids.extend(data["ids"])
+    hot = client.request("POST /inventory", "POST", "/api/inventory",
+        {"name": "hot-sku", "condition": "new", "quantity": 0, "restock_level": 0})
+    return {"ids": ids, "hot_id": hot["id"]}
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of sorted latencies"""
+    return latencies[min(len(latencies) - 1, max(0, math.ceil(fraction * len(latencies)) - 1))]
+
+
+def drive(profile, host: str, port: int, seeded: dict, clients: int, duration: float) -> dict:
+    """Runs a profile from many client threads for duration seconds"""
+    workers = [Client(host, port, seed) for seed in range(1, clients + 1)]
+    stop = threading.Event()
+    barrier = threading.Barrier(clients + 1)
+
+    def loop(client: Client):
+        barrier.wait()
+        while not stop.is_set():
+            profile(client, seeded)
+
+    threads = [threading.Thread(target=loop, args=(client,)) for client in workers]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    for client in workers:
+        for endpoint, values in client.latencies.items():
+            latencies[endpoint].extend(values)
+        for endpoint, count in client.errors.items():
+            errors[endpoint] += count
+    endpoints = {}
+    for endpoint in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies[endpoint])
+        result = {
+            "requests": len(values) + errors[endpoint],
+            "errors": errors[endpoint],
+            "throughput": round(len(values) / elapsed, 1),
+        }
+        if values:
+            result.update({name: round(percentile(values, fraction) * 1000, 3) for name, fraction in PERCENTILES})
+        endpoints[endpoint] = result
+    total = sum(result["requests"] for result in endpoints.values())
+    return {
+        "seconds": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(errors.values()),
+        "throughput": round(total / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+def main():
+    """Starts the service, runs the profiles and writes the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+        help="profile to run, may be repeated (default: all)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument("--worker-class", default="gthread", help="gunicorn worker class")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent client connections")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per profile")
+    parser.add_argument("--rows", type=int, default=10000, help="Inventory seeded before the run")
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--url", help="drive a running service instead of starting gunicorn")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "load-results.json"),
+        help="where the results are written (default: benchmarks/load-results.json, git-ignored)")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        location = urlsplit(args.url)
+        host, port = location.hostname, location.port or 80
+    else:
+        host, port = "localhost", args.port
+        server = start_server(args)
+    try:
+        seeded = seed(host, port, args.rows)
+        results = {}
+        for name in args.profile or sorted(PROFILES):
+            result = results[name] = drive(PROFILES[name], host, port, seeded, args.clients, args.duration)
+            print("{}: {} req/s, {} errors".format(name, result["throughput"], result["errors"]))
+            for endpoint, data in result["endpoints"].items():
+                print("  {:<32} {:>9} req/s  p50 {} p95 {} p99 {} p999 {} ms".format(
+                    endpoint, data["throughput"], data.get("p50"), data.get("p95"),
+                    data.get("p99"), data.get("p999")))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    with open(args.output, "w") as file:
+        json.dump({
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "server": args.url or {
+                "workers": args.workers, "threads": args.threads, "worker_class": args.worker_class,
+            },
+            "clients": args.clients,
+            "rows": args.rows,
+            "profiles": results,
+        }, file, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
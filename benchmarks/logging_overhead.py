@@ -0,0 +1,97 @@
+"""
+Microbenchmark of what logging costs the request thread
+
+Emits the info lines of a typical request (route and model messages with
+%-style arguments) to a file, first through a synchronous handler as the
+service did before and then through the queued JSON pipeline of
+service.logs, with and without sampling, and reports the time the calling
+thread spends per request. Every pipeline is run against a plain file and
+against a sink that stalls on each write, like a slow log pipe.
+
+Run it with:
+    python -m benchmarks.logging_overhead --requests 20000 --stall-us 200
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from service.logs import init_logging
+
+LINES_PER_REQUEST = (
+    ("Request to increases inventory [%s] stock by [%s]", (42, 7)),
+    ("Processing lookup for id %s ...", (42,)),
+    ("Inventory with id [%s] stock increased successfully", (42,)),
+)
+
+
+def emit(logger: logging.Logger, requests: int) -> float:
+    """Logs the lines of requests requests and returns the seconds spent"""
+    start = time.perf_counter()
+    for inv_id in range(requests):
+        for message, args in LINES_PER_REQUEST:
+            logger.info(message, *args)
+    return time.perf_counter() - start
+
+
+class StallingFileHandler(logging.FileHandler):
+    """A file handler that blocks for a while on every write"""
+
+    def __init__(self, path: str, stall: float):
+        super().__init__(path)
+        self.stall = stall
+
+    def emit(self, record):
+        time.sleep(self.stall)
+        super().emit(record)
+
+
+def synchronous(logger: logging.Logger, handler: logging.Handler):
+    """The old pipeline: a formatter and file I/O on the request thread"""
+    handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
+    ))
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    return handler.close
+
+
+def queued(logger: logging.Logger, handler: logging.Handler, rate: float = 1.0):
+    """The queued JSON pipeline, keeping rate of the info lines"""
+    listener = init_logging([logger], [handler], logging.INFO, {logging.INFO: rate})
+    return lambda: (listener.stop(), handler.close())
+
+
+def main():
+    """Times every pipeline and prints the cost per request"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--stall-us", type=float, default=200,
+        help="how long the slow sink blocks on every write")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmarks.logging")
+    logger.propagate = False
+    pipelines = (
+        ("synchronous", lambda handler: synchronous(logger, handler)),
+        ("queued", lambda handler: queued(logger, handler)),
+        ("queued 10%", lambda handler: queued(logger, handler, 0.1)),
+    )
+    sinks = (
+        ("file", logging.FileHandler),
+        ("slow sink", lambda path: StallingFileHandler(path, args.stall_us / 1e6)),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for sink, handler_class in sinks:
+            for name, setup in pipelines:
+                close = setup(handler_class(os.path.join(directory, "bench.log")))
+                emit(logger, 100)  # warm up
+                seconds = emit(logger, args.requests)
+                close()
+                print("{:<10} {:<12} {:>8.2f} us per request".format(
+                    sink, name, seconds * 1e6 / args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Microbenchmark of the per-request cost of the Prometheus instrumentation
+
+Times the before_request and after_request hooks of service.metrics around a
+listing request context, without serving the request itself, so the number
+is what the metrics add on top of every request. The hooks are timed once
+in-process and once with PROMETHEUS_MULTIPROC_DIR set, as gunicorn.conf.py
+runs the service, where every value is written to a memory-mapped file.
+
+Run it with:
+    python -m benchmarks.metrics_overhead --requests 100000 --repeat 5
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+def time_hooks(requests: int, repeat: int) -> float:
+    """Returns the best time of the metrics hooks per request, in microseconds"""
+    from flask import Response
+    from service import app
+
+    logging.disable(logging.CRITICAL)
+    metrics = app.extensions["metrics"]
+    response = Response()
+    with app.test_request_context("/api/inventory"):
+        def hooks():
+            metrics.start()
+            metrics.finish(response)
+
+        hooks()
+        best = min(timeit.repeat(hooks, number=requests, repeat=repeat))
+    return best * 1e6 / requests
+
+
+def main():
+    """Times the metrics hooks in both modes and prints their cost per request"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mode", choices=("in-process", "multiprocess"),
+        help="time a single mode in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.mode:
+        print("{:.2f}".format(time_hooks(args.requests, args.repeat)))
+        return
+    # The mode is chosen when prometheus_client is imported, so each one
+    # runs in a fresh interpreter
+    for mode in ("in-process", "multiprocess"):
+        env = dict(os.environ)
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            if mode == "multiprocess":
+                env["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.metrics_overhead", "--mode", mode,
+                    "--requests", str(args.requests), "--repeat", str(args.repeat)],
+                env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True,
+            ).stdout
+        print("metrics hooks {:<12} {:>8.2f} us per request".format(
+            mode, float(output.strip().splitlines()[-1])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Read path benchmark of listing Inventory
+
+Loads rows with create_many() and then lists them all, first through the ORM
+(query.all() and serialize() on every Inventory) and then through the Core
+column projection (find_rows() and serialize_rows()), reporting the CPU time
+and the tracemalloc peak of each per 100k rows.
+
+Run it with:
+    python -m benchmarks.projection --rows 100000 --repeat 3
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+from service.models import Inventory, db
+from tests.factories import InventoryFactory
+
+
+def orm(query) -> list:
+    """The list path before find_rows: Inventory instances then serialize()"""
+    results = [inv.serialize() for inv in query.all()]
+    db.session.expunge_all()
+    return results
+
+
+def projection(query) -> list:
+    """The Core column projection path"""
+    return Inventory.serialize_rows(Inventory.find_rows(query))
+
+
+def measure(path, repeat: int) -> dict:
+    """Runs a list path repeat times and keeps the best CPU time and peak memory"""
+    seconds, peak = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.process_time()
+        path(Inventory.query)
+        seconds.append(time.process_time() - start)
+        peak.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"path": path.__name__, "seconds": min(seconds), "peak": min(peak)}
+
+
+def main():
+    """Times both list paths and prints the cost per 100k rows"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    db.drop_all()
+    db.create_all()
+    records = [inv.serialize() for inv in InventoryFactory.build_batch(args.rows)]
+    Inventory.create_many(records)
+    assert sorted(orm(Inventory.query), key=lambda data: data["id"]) == \
+        sorted(projection(Inventory.query), key=lambda data: data["id"])
+    scale = 100000 / args.rows
+    for path in (orm, projection):
+        result = measure(path, args.repeat)
+        print("{:<12} {:>8.0f} ms CPU  {:>8.1f} MiB peak per 100k rows".format(
+            result["path"], result["seconds"] * 1000 * scale, result["peak"] * scale / 2**20))
+    db.session.remove()
+    db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Microbenchmark of serializing Inventory lists
+
+Compares the old list path, where every row went through serialize() and then
+through flask-restx marshalling of inventory_model before json.dumps, with the
+current path of serialize() encoded straight with orjson.
+
+Run it with:
+    python -m benchmarks.serialization --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import logging
+import timeit
+
+import orjson
+from flask_restx import marshal
+
+from service.routes import inventory_model
+from tests.factories import InventoryFactory
+
+
+def marshalled(invs) -> bytes:
+    """serialize(), marshal with inventory_model, then json.dumps"""
+    results = [inv.serialize() for inv in invs]
+    return json.dumps(marshal(results, inventory_model)).encode()
+
+
+def direct(invs) -> bytes:
+    """serialize() encoded with orjson"""
+    return orjson.dumps([inv.serialize() for inv in invs])
+
+
+def main():
+    """Times both serialization paths and prints the cost per 10k rows"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    invs = InventoryFactory.build_batch(args.rows)
+    assert json.loads(marshalled(invs)) == json.loads(direct(invs))
+    for path in (marshalled, direct):
+        best = min(timeit.repeat(lambda: path(invs), number=1, repeat=args.repeat))
+        print("{:<12} {:>8.2f} ms per 10k rows".format(path.__name__, best * 1000 * 10000 / args.rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark suite of the model and serialization layers
+
+For every table size it loads that many rows made by InventoryFactory with
+create_many() and times deserialize(), serialize(), create(), find_by_id(),
+every finder and the serialization of the whole list, both through the ORM
+and through the column projection. Results are written as JSON so that a
+later run can be compared against them as a baseline.
+
+It runs against the database in DATABASE_URI, which it empties, so point it
+at SQLite or a throwaway Postgres:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.suite run --rows 1000 100000
+    python -m benchmarks.suite run --rows 1000 100000 1000000 --output baseline.json
+    python -m benchmarks.suite compare baseline.json benchmarks/baselines/sqlite.json --threshold 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import orjson
+
+from service.models import Inventory, Condition, db
+from tests.factories import inventory_records
+
+LOAD_CHUNK = 10000  # records per create_many() call while loading a table
+
+
+def time_best(function, repeat: int) -> float:
+    """Returns the fastest of repeat runs of function, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+        db.session.rollback()  # start every run from a clean session
+        db.session.expunge_all()
+    return best
+
+
+def load(rows: int):
+    """Replaces the inventory table with rows fake Inventory"""
+    db.drop_all()
+    db.create_all()
+    records = inventory_records(rows)
+    for start in range(0, rows, LOAD_CHUNK):
+        Inventory.create_many(records[start:start + LOAD_CHUNK], LOAD_CHUNK)
+    db.session.expunge_all()
+
+
+def build(data: dict) -> Inventory:
+    """Returns a new Inventory deserialized from data"""
+    inv = Inventory()
+    inv.deserialize(data)
+    return inv
+
+
+def cases(rows: int) -> dict:
+    """Returns the benchmarks of one table size as name: (function, operations)"""
+    sample = min(rows, 10000)
+    records = inventory_records(sample)
+    invs = [build(data) for data in records]
+    ids = [row[0] for row in db.session.query(Inventory.id).limit(sample)]
+    lookups = random.Random(0).choices(ids, k=1000)
+    new = inventory_records(100)
+
+    def create():
+        for data in new:
+            build(data).create()
+
+    return {
+        "deserialize": (lambda: [build(data) for data in records], sample),
+        "serialize": (lambda: [inv.serialize() for inv in invs], sample),
+        "create": (create, len(new)),
+        "find_by_id": (lambda: [Inventory.find_by_id(inv_id) for inv_id in lookups], len(lookups)),
+        "find_by_name": (lambda: Inventory.find_by_name("fan").all(), 1),
+        "find_by_condition": (lambda: Inventory.find_by_condition(Condition.used).all(), 1),
+        "find_by_need_restock": (lambda: Inventory.find_by_need_restock().all(), 1),
+        "find_by_filters": (lambda: Inventory.find_by_filters(
+            name="fan", condition=Condition.new, need_restock=True).all(), 1),
+        "top_shortfall": (lambda: Inventory.find_rows(Inventory.sort_by_shortfall(
+            Inventory.find_by_need_restock(), weighted=True), limit=100), 1),
+        "list_orm": (lambda: orjson.dumps([inv.serialize() for inv in Inventory.find_all()]), 1),
+        "list_rows": (lambda: orjson.dumps(Inventory.serialize_rows(Inventory.find_rows())), 1),
+    }
+
+
+def run(args) -> int:
+    """Runs every benchmark at every table size and writes the results"""
+    logging.disable(logging.CRITICAL)
+    dialect = db.session.get_bind().dialect.name
+    results = {}
+    for rows in args.rows:
+        print("Loading {} rows into {} ...".format(rows, dialect), file=sys.stderr)
+        load(rows)
+        results[str(rows)] = {}
+        for name, (function, operations) in cases(rows).items():
+            seconds = time_best(function, args.repeat)
+            results[str(rows)][name] = {"operations": operations, "us_per_op": round(seconds * 1e6 / operations, 3)}
+            print("{:>9} rows  {:<22} {:>14.3f} us/op".format(rows, name, seconds * 1e6 / operations))
+    db.session.remove()
+    db.drop_all()
+    output = args.output or os.path.join(os.path.dirname(__file__), "baselines", dialect + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({
+            "database": dialect,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "repeat": args.repeat,
+            "results": results,
+        }, file, indent=2)
+    print("Results written to {}".format(output), file=sys.stderr)
+    return 0
+
+
+def compare(args) -> int:
+    """Compares two result files and fails when a benchmark got slower than the threshold"""
+    with open(args.baseline) as file:
+        baseline = json.load(file)["results"]
+    with open(args.current) as file:
+        current = json.load(file)["results"]
+    regressions = 0
+    for rows, benchmarks in current.items():
+        for name, result in benchmarks.items():
+            before = baseline.get(rows, {}).get(name)
+            if before is None:
+                continue
+            change = result["us_per_op"] / before["us_per_op"] - 1 if before["us_per_op"] else 0.0
+            flag = ""
+            if change > args.threshold:
+                flag = "REGRESSION"
+                regressions += 1
+            print("{:>9} rows  {:<22} {:>14.3f} -> {:>14.3f} us/op  {:>+7.1%}  {}".format(
+                rows, name, before["us_per_op"], result["us_per_op"], change, flag))
+    print("{} regression(s) above {:.0%}".format(regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+def main():
+    """Parses the command line and runs or compares the suite"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the suite and write the results")
+    run_parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--output", help="defaults to benchmarks/baselines/<database>.json")
+    run_parser.set_defaults(handler=run)
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+        help="relative slowdown that counts as a regression")
+    compare_parser.set_defaults(handler=compare)
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
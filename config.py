@@ -5,6 +5,10 @@ import os
 import json
 import logging
 
+def env_flag(name: str, default: str) -> bool:
+    """Reads a true/false environment variable"""
+    return os.getenv(name, default).lower() in ("true", "1", "yes")
+
 # Get configuration from environment
 # DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///../db/test.db')
 DATABASE_URI = os.getenv(
@@ -22,6 +26,51 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of every worker process (SQLite does not use a queue pool)
+# By default there is one connection per gunicorn worker thread
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if not DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", os.getenv("GUNICORN_THREADS", "8"))),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "true"),
+    }
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Fraction of the log records kept per level, e.g. LOG_SAMPLE_INFO=0.1 keeps
+# one in ten info lines; warnings and errors are always kept
+LOG_SAMPLE_RATES = {
+    logging.DEBUG: float(os.getenv("LOG_SAMPLE_DEBUG", "1")),
+    logging.INFO: float(os.getenv("LOG_SAMPLE_INFO", "1")),
+}
+
+# Allows POST /api/internal/reset to truncate and reseed the inventory
+ALLOW_RESET = env_flag("ALLOW_RESET", "false")
+
+# Number of rows written per INSERT by the bulk endpoints
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Number of rejected rows an import reports line by line
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Largest page the list endpoint returns when paginating
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Number of rows fetched per round trip when streaming the inventory
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Number of rows exported by every COPY on PostgreSQL
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+
+# Read-through cache of single Inventory lookups, per worker process
+CACHE_ENABLED = env_flag("CACHE_ENABLED", "true")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+# Statements slower than this many milliseconds are logged with their parameters
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
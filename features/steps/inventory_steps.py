@@ -15,12 +15,9 @@ from compare import expect
 def step_impl(context):
     """ Delete all Inventory and load new ones """
     headers = {'Content-Type': 'application/json'}
-    # list all of the inventory and delete them one by one
-    context.resp = requests.get(context.base_url + '/api/inventory')
+    # delete all of the inventory with a single request
+    context.resp = requests.delete(context.base_url + '/api/inventory', params={'all': 'true'})
     expect(context.resp.status_code).to_equal(200)
-    for inv in context.resp.json():
-        context.resp = requests.delete(context.base_url + '/api/inventory/' + str(inv["id"]), headers=headers)
-        expect(context.resp.status_code).to_equal(204)
     
     # load the database with new inventory
     create_url = context.base_url + '/api/inventory'
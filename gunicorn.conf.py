@@ -1,6 +1,30 @@
+import glob
 import os
+import tempfile
 
 PORT = os.getenv("PORT", "5000")
 bind = "0.0.0.0:" + PORT
-workers = 1
+# Every worker thread holds its own database connection while it waits on a
+# query, so workers * threads requests can be in flight at once
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
 log_level = "info"
+
+# Workers write their Prometheus metrics to files in this directory so that
+# /metrics can aggregate them, see service/metrics.py
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "inventory-metrics"))
+
+
+def on_starting(server):
+    """Starts every run with an empty metrics directory"""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker that exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -16,21 +16,21 @@ app.config.from_object("config") # loads config.py
 # Model first
 # Import the routes after the Flask app is created
 # Error handler after routes (api) is created
-from service import models, routes, error_handlers
+from service import models, routes, error_handlers, metrics, logs, commands
+
+metrics.RequestMetrics(app)
 
 # Set up logging for production
 print("Setting up logging for {}...".format(__name__))
 app.logger.propagate = False
 if __name__ != "__main__":
     gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
+    # Requests only queue their records, a listener thread writes them as JSON.
+    # The models and metrics modules log to flask.app, the routes to app.logger
+    logs.init_logging(
+        [app.logger, logging.getLogger("flask.app")],
+        gunicorn_logger.handlers, gunicorn_logger.level, app.config["LOG_SAMPLE_RATES"]
     )
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
     app.logger.info("Logging handler established")
 
 app.logger.info(70 * "*")
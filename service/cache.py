@@ -0,0 +1,95 @@
+"""
+In-process cache for the Inventory Service
+
+LRUCache keeps the most recently used entries of one worker process in
+memory. Entries expire after a TTL so that writes made by other processes
+are picked up eventually; writes made by this process invalidate the
+entries they touch right away.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread safe least recently used cache whose entries expire"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0, enabled: bool = True, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled and max_size > 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def token(self) -> int:
+        """
+        Returns a token to take before reading the value to cache
+
+        set() ignores values read before the most recent invalidation,
+        so a slow reader cannot put back a row a writer just replaced
+        """
+        return self._generation
+
+    def get(self, key):
+        """Returns the cached value of key, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, token: int = None):
+        """Caches value under key unless an invalidation happened since token"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Removes keys from the cache"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the configuration and counters of the cache"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
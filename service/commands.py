@@ -0,0 +1,20 @@
+"""
+Flask CLI commands of the Inventory Service
+
+Run them with the flask command, e.g.:
+    flask import-inventory catalog.csv
+"""
+import click
+from service import app
+from service.routes import import_csv
+
+
+@app.cli.command("import-inventory")
+@click.argument("file", type=click.File("rb"))
+def import_inventory(file):
+    """Imports Inventory from a CSV file, or - for standard input"""
+    result = import_csv(file)
+    click.echo("Inserted {inserted}, updated {updated}, rejected {rejected} "
+        "in {seconds} s ({rows_per_second} rows/s)".format(**result))
+    for error in result["errors"]:
+        click.echo("line {line}: {message}".format(**error), err=True)
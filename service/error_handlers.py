@@ -1,5 +1,5 @@
 # from flask import jsonify
-from service.models import DataValidationError, DatabaseConnectionError
+from service.models import DataValidationError, DatabaseConnectionError, InsufficientStockError
 from service import app, status
 from service.routes import api
 from werkzeug.exceptions import NotFound, BadRequest, MethodNotAllowed, UnsupportedMediaType, InternalServerError
@@ -24,6 +24,17 @@ def request_validation_error(error):
     """ Handles Value Errors from bad data """
     return bad_request(error)
 
+@api.errorhandler(InsufficientStockError)
+def insufficient_stock(error):
+    """ Handles stock that cannot cover a decrease with 409_CONFLICT """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
 @api.errorhandler(BadRequest)
 def bad_request(error):
     """ Handles bad reuests with 400_BAD_REQUEST """
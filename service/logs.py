@@ -0,0 +1,106 @@
+"""
+Logging pipeline for the Inventory Service
+
+Request threads only put records on an in-memory queue; a QueueListener
+thread formats them as JSON lines and writes them to the real handlers, so
+log I/O never adds to request latency. Messages keep their %-style arguments
+until the listener formats them, and high-volume levels can be sampled down
+before they are queued at all.
+"""
+import atexit
+import itertools
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(data).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1/rate records of the sampled levels
+
+    Levels without a rate, and every level above the sampled ones such as
+    warnings and errors, are always kept
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.every = {
+            level: max(1, round(1 / rate)) if rate > 0 else 0
+            for level, rate in rates.items() if rate < 1
+        }
+        self.counters = {level: itertools.count() for level in self.every}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = self.every.get(record.levelno)
+        if every is None:
+            return True
+        return every > 0 and next(self.counters[record.levelno]) % every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    A QueueHandler that leaves formatting to the listener
+
+    QueueHandler.prepare() formats the message on the calling thread so the
+    record can be pickled; the queue here never leaves the process, so the
+    record is queued as it is
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _flush(listener: QueueListener):
+    """Writes out the queued records of a listener that is still running"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def init_logging(loggers: list, handlers: list, level: int, sample_rates: dict) -> QueueListener:
+    """
+    Routes loggers through one queue to JSON formatted handlers
+
+    :param loggers: the loggers the service writes to
+    :param handlers: the handlers that do the actual I/O
+    :param level: the level of the loggers
+    :param sample_rates: the fraction of records kept per level, e.g. {logging.INFO: 0.1}
+
+    :return: the started listener, which is stopped at exit
+    :rtype: QueueListener
+
+    """
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_flush, listener)
+    queue_handler = LazyQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+    for logger in loggers:
+        logger.handlers = [queue_handler]
+        logger.setLevel(level)
+        logger.propagate = False
+    return listener
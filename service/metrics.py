@@ -0,0 +1,261 @@
+"""
+Prometheus metrics for the Inventory Service
+
+Every request is timed by resource, method and status; the _count of that
+histogram is the request count. The SQL statements a request ran and the time
+they took are histograms by resource and method too, but their observations
+are bucketed in the worker and written at most once per GAUGE_INTERVAL
+seconds, when the cache and pool gauges are refreshed, so a request only pays
+for one observe().
+
+Statements slower than SLOW_QUERY_MS are logged with their parameters and
+route. Resource methods declare how many statements they expect with
+@query_budget(n), and a request over its budget is logged, or raises
+QueryBudgetExceeded when the app is TESTING.
+
+When PROMETHEUS_MULTIPROC_DIR is set before the service is imported, every
+gunicorn worker writes its values to files in that directory and /metrics
+aggregates the files of all the workers.
+"""
+import os
+import time
+from bisect import bisect_left
+import logging
+import threading
+from flask import request, has_request_context
+from prometheus_client import (
+    CollectorRegistry, Gauge, Histogram, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from service import pool
+from service.models import Inventory, db
+
+logger = logging.getLogger("flask.app")
+
+GAUGE_INTERVAL = 1.0
+
+# Statements running longer than this many seconds are logged, see RequestMetrics
+slow_query_seconds = float("inf")
+
+# The RequestState of the request a worker thread is serving, as its state
+# attribute. A thread local is far cheaper to reach than flask.g
+_current = threading.local()
+
+LATENCY = Histogram(
+    "inventory_http_request_duration_seconds", "Time spent serving a request",
+    ["resource", "method", "status"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+DB_STATEMENTS = Histogram(
+    "inventory_db_statements_per_request", "SQL statements executed by a request",
+    ["resource", "method"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_TIME = Histogram(
+    "inventory_db_duration_seconds", "Time a request spent executing SQL statements",
+    ["resource", "method"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+CACHE_SIZE = Gauge(
+    "inventory_cache_entries", "Inventory held by the cache",
+    multiprocess_mode="livesum",
+)
+CACHE_EVENTS = Gauge(
+    "inventory_cache_events", "Cache lookups and removals since the workers started",
+    ["event"], multiprocess_mode="livesum",
+)
+POOL_CONNECTIONS = Gauge(
+    "inventory_db_pool_connections", "Database connections of the pools by state",
+    ["state"], multiprocess_mode="livesum",
+)
+POOL_EVENTS = Gauge(
+    "inventory_db_pool_events", "Connection pool events since the workers started",
+    ["event"], multiprocess_mode="livesum",
+)
+
+_CACHE_EVENTS = ("hits", "misses", "evictions", "expirations")
+_POOL_EVENTS = ("connects", "closes", "invalidations", "checkouts", "checkins", "timeouts")
+_POOL_STATES = ("checked_out", "idle", "overflow")
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in testing when a request runs more statements than its budget"""
+
+
+def query_budget(statements: int):
+    """Declares how many SQL statements a resource method may run per request"""
+    def decorator(function):
+        function.query_budget = statements
+        return function
+    return decorator
+
+
+def set_query_budget(statements: int):
+    """Replaces the budget of the current request once its size is known"""
+    _current.state.query_budget = statements
+
+
+class RequestState:
+    """The clock and SQL counters of one request"""
+    __slots__ = ("start", "db_statements", "db_time", "query_budget")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.db_statements = 0
+        self.db_time = 0.0
+        self.query_budget = None
+
+
+class PendingHistogram:
+    """Observations of a histogram child that are not written to it yet"""
+    __slots__ = ("child", "counts", "sum")
+
+    def __init__(self, child):
+        self.child = child
+        self.counts = [0] * len(child._upper_bounds)
+        self.sum = 0
+
+    def observe(self, amount):
+        """Counts an observation in the first bucket it fits, as Histogram.observe() does"""
+        self.counts[bisect_left(self.child._upper_bounds, amount)] += 1
+        self.sum += amount
+
+    def flush(self):
+        """Writes the observations counted since the last flush to the child"""
+        if not any(self.counts):
+            return
+        # Histogram.observe() only takes one value, its buckets are written
+        # directly so that a flush costs one write per bucket
+        for index, count in enumerate(self.counts):
+            if count:
+                self.child._buckets[index].inc(count)
+                self.counts[index] = 0
+        self.child._sum.inc(self.sum)
+        self.sum = 0
+
+
+class RequestMetrics:
+    """Records the metrics of the requests served by one Flask app"""
+
+    def __init__(self, app):
+        global slow_query_seconds
+        slow_query_seconds = app.config["SLOW_QUERY_MS"] / 1000
+        self.app = app
+        self._resources = {}
+        self._children = {}  # (endpoint, method, status) -> (histogram, pending SQL histograms, view)
+        self._lock = threading.Lock()
+        self._pending = {}  # (resource, method) -> PendingHistogram of statements and of seconds
+        self._gauges_at = 0.0
+        app.extensions["metrics"] = self
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def resource(self, endpoint) -> tuple:
+        """Returns the name and the class of the flask-restx resource behind an endpoint"""
+        try:
+            return self._resources[endpoint]
+        except KeyError:
+            view_class = getattr(self.app.view_functions.get(endpoint), "view_class", None)
+            name = getattr(view_class, "__name__", endpoint or "unmatched")
+            self._resources[endpoint] = name, view_class
+            return name, view_class
+
+    def start(self):
+        """Starts the clocks of a request"""
+        _current.state = RequestState(time.perf_counter())
+
+    def finish(self, response):
+        """Records the request once its response is ready"""
+        state = _current.state
+        _current.state = None  # statements of a streamed response are not counted
+        elapsed = time.perf_counter() - state.start
+        req = request._get_current_object()
+        key = (req.endpoint, req.method, response.status_code)
+        try:
+            latency, pending, view = self._children[key]
+        except KeyError:
+            latency, pending, view = self._children[key] = self.children(*key)
+        latency.observe(elapsed)
+        with self._lock:
+            pending[0].observe(state.db_statements)
+            pending[1].observe(state.db_time)
+        budget = state.query_budget
+        if budget is None:
+            budget = getattr(view, "query_budget", None)
+        if budget is not None and state.db_statements > budget:
+            self.over_budget(req, state.db_statements, budget)
+        if state.start - self._gauges_at >= GAUGE_INTERVAL:
+            self._gauges_at = state.start
+            self.flush()
+        return response
+
+    def children(self, endpoint, method: str, status: int) -> tuple:
+        """Returns the histogram, the pending SQL histograms and the view method of a kind of request"""
+        name, view_class = self.resource(endpoint)
+        with self._lock:
+            pending = self._pending.get((name, method))
+            if pending is None:
+                pending = self._pending[name, method] = (
+                    PendingHistogram(DB_STATEMENTS.labels(name, method)),
+                    PendingHistogram(DB_TIME.labels(name, method)),
+                )
+        return LATENCY.labels(name, method, status), pending, getattr(view_class, method.lower(), None)
+
+    def over_budget(self, req, statements: int, budget: int):
+        """Reports a request that ran more statements than its resource declared"""
+        message = "{} {} ran {} SQL statements, its budget is {}".format(
+            req.method, req.path, statements, budget)
+        if self.app.config["TESTING"]:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    def flush(self):
+        """Writes the pending SQL histograms and refreshes the gauges"""
+        with self._lock:
+            for statements, seconds in self._pending.values():
+                statements.flush()
+                seconds.flush()
+        self.refresh_gauges()
+
+    def refresh_gauges(self):
+        """Copies the cache and pool counters of this worker into the gauges"""
+        cache = Inventory.cache.stats()
+        CACHE_SIZE.set(cache["size"])
+        for name in _CACHE_EVENTS:
+            CACHE_EVENTS.labels(name).set(cache[name])
+        snapshot = pool.stats.snapshot(db.engine.pool)
+        for name in _POOL_STATES:
+            POOL_CONNECTIONS.labels(name).set(snapshot.get(name, 0))
+        for name in _POOL_EVENTS:
+            POOL_EVENTS.labels(name).set(snapshot[name])
+
+
+def render():
+    """Returns the Prometheus text exposition and its content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_start"]
+    state = getattr(_current, "state", None)
+    if state is not None:
+        state.db_statements += 1
+        state.db_time += elapsed
+    if elapsed > slow_query_seconds:
+        route = "{} {}".format(request.method, request.path) if has_request_context() else "outside a request"
+        logger.warning("Slow query (%.1f ms) from %s: %s %.1000r",
+            elapsed * 1000, route, statement, parameters)
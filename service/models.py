@@ -13,10 +13,20 @@ name (string) - the name of the product
 quantity (int) - the quantity of the product
 
 """
+import io
+import csv
 import logging
+import itertools
 from enum import Enum
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, bindparam, case, event, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import Grouping
+from sqlalchemy.sql.functions import FunctionElement
+from service.cache import LRUCache
+from service.pool import InstrumentedQueuePool
 
 logger = logging.getLogger("flask.app")
 
@@ -35,6 +45,9 @@ class DatabaseConnectionError(Exception):
 class DataValidationError(Exception):
     """Custom Exception with data validation fails"""
 
+class InsufficientStockError(Exception):
+    """Custom Exception when there is not enough stock to remove"""
+
 class Condition(Enum):
     """ 
     Enumeration of Condition of an Inventory 
@@ -44,9 +57,61 @@ class Condition(Enum):
     new = 2
     unknown = 3
 
+# How much a unit short of restock counts per condition when sorting by
+# weighted shortfall, new stock being the most urgent to reorder
+SHORTFALL_WEIGHTS = {
+    Condition.new: 4,
+    Condition.slightly_used: 3,
+    Condition.used: 2,
+    Condition.unknown: 1,
+}
+
+def shortfall_of(quantity, restock_level, condition=None):
+    """
+    Builds the restock shortfall expression, weighted when a condition is given
+
+    The sort and its indexes must use the very same expression, so both
+    are built here
+    """
+    shortfall = restock_level - quantity
+    if condition is not None:
+        weights = {condition.name: weight for condition, weight in SHORTFALL_WEIGHTS.items()}
+        shortfall = shortfall * case(weights, value=condition)
+    # Index expressions must be parenthesized
+    return Grouping(shortfall)
+
+# Counter of the Inventory versions, created by create_all() on PostgreSQL
+VERSION_SEQUENCE = db.Sequence("inventory_version_seq", metadata=db.Model.metadata)
+
+class NextVersion(FunctionElement):
+    """
+    A new version for a written Inventory, drawn from a counter of the whole table
+
+    Versions are never handed out twice, not even to a row that reuses the
+    id of a deleted one, so an id and a version always name the same data
+    """
+    name = "next_version"
+    type = db.BigInteger()
+
+@compiles(NextVersion, "postgresql")
+def _next_version_postgresql(element, compiler, **kw):
+    return "nextval('inventory_version_seq')"
+
+@compiles(NextVersion)
+def _next_version(element, compiler, **kw):
+    # Without sequences the triggers of the table stamp the version, see below
+    return "version"
+
+# The columns serialize() returns
+SERIALIZED_COLUMNS = ("id", "name", "condition", "quantity", "restock_level")
+
+# Largest quantity or restock level an INTEGER column holds on PostgreSQL
+MAX_INTEGER = 2 ** 31 - 1
+
 class Inventory(db.Model):
     
     app:Flask = None
+    cache:LRUCache = LRUCache(enabled=False) # serialized Inventory by id
     
     # Inventory Schema 
     id = db.Column(db.Integer, primary_key=True) # row entries
@@ -56,6 +121,26 @@ class Inventory(db.Model):
     ) # Unknown is the default condition
     quantity = db.Column(db.Integer, nullable=False)
     restock_level = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False, server_default="1") # renewed by every write, see NextVersion
+
+    # Indexes serving the filters of the list endpoint, all ordered by id
+    __table_args__ = (
+        db.Index("ix_inventory_name", name),
+        db.Index("ix_inventory_condition_id", condition, id),
+        # Partial index holding only the rows of find_by_need_restock()
+        db.Index("ix_inventory_need_restock", id,
+            postgresql_where=(quantity <= restock_level),
+            sqlite_where=(quantity <= restock_level)),
+        # The same rows by shortfall, so the top K most urgent are read in
+        # order. The weighted sort has no index of its own, every index on
+        # quantity is paid by each stock update
+        db.Index("ix_inventory_shortfall",
+            shortfall_of(quantity, restock_level).desc(), id,
+            postgresql_where=(quantity <= restock_level),
+            sqlite_where=(quantity <= restock_level)),
+        # Ids of deleted rows are never handed out again, like a PostgreSQL sequence
+        {"sqlite_autoincrement": True},
+    )
     
     ##################################################
     # INSTANCE METHODS
@@ -75,7 +160,14 @@ class Inventory(db.Model):
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
+        db.session.flush()
+        written = {column: getattr(self, column) for column in SERIALIZED_COLUMNS}
         db.session.commit()
+        # The commit expired the instance, put back what was just written
+        # so that serializing it does not cost another SELECT
+        for column, value in written.items():
+            set_committed_value(self, column, value)
+        self.cache.invalidate(self.id)
     
     def update(self):
         """
@@ -84,15 +176,19 @@ class Inventory(db.Model):
         logger.info("Updating %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        self.version = NextVersion()
         db.session.commit()
+        self.cache.invalidate(self.id)
 
     def delete(self):
         """
         Removes an Inventory from the data store
         """
         logger.info("Deleting %s", self.name)
+        inv_id = self.id
         db.session.delete(self)
         db.session.commit()
+        self.cache.invalidate(inv_id)
 
     def serialize(self) -> dict:
         """
@@ -106,6 +202,35 @@ class Inventory(db.Model):
             "restock_level": self.restock_level
         }
     
+    @staticmethod
+    def serialize_row(row) -> dict:
+        """
+        Serializes a row of the inventory table into a dictionary
+        """
+        return {
+            "id": row.id,
+            "name": row.name,
+            "condition": row.condition.name, # enum to string
+            "quantity": row.quantity,
+            "restock_level": row.restock_level
+        }
+
+    @staticmethod
+    def serialize_rows(rows) -> list:
+        """
+        Serializes rows returned by find_rows() into dictionaries
+        """
+        return [
+            {
+                "id": id,
+                "name": name,
+                "condition": condition.name, # enum to string
+                "quantity": quantity,
+                "restock_level": restock_level
+            }
+            for id, name, condition, quantity, restock_level, _ in rows
+        ]
+
     def deserialize(self, data):
         """ 
         Deserializes an Inventory from a dictionary 
@@ -115,11 +240,16 @@ class Inventory(db.Model):
         try:
             self.id = data["id"] if "id" in data.keys() else None
             self.name = data["name"]
+            if not isinstance(self.name, str) or not self.name:
+                raise DataValidationError("Invalid type/value for name [%s]" % str(type(self.name)))
+            max_length = self.__table__.c.name.type.length
+            if len(self.name) > max_length:
+                raise DataValidationError("Invalid value for name, longer than %d characters" % max_length)
             self.condition = getattr(Condition, data["condition"]) # string to enmu
-            if not isinstance(data["quantity"], int) or data["quantity"] < 0:
+            if not isinstance(data["quantity"], int) or not 0 <= data["quantity"] <= MAX_INTEGER:
                 raise DataValidationError("Invalid type/value for quantity [%s] [%d]" % \
                     (str(type(data["quantity"])), data["quantity"]))
-            if not isinstance(data["restock_level"], int) or data["restock_level"] < 0:
+            if not isinstance(data["restock_level"], int) or not 0 <= data["restock_level"] <= MAX_INTEGER:
                 raise DataValidationError("Invalid type/value for restock_level [%s] [%d]" % \
                     (str(type(data["restock_level"])), data["restock_level"]))
             self.quantity = data["quantity"]
@@ -146,11 +276,589 @@ class Inventory(db.Model):
         """
         logger.info("Initializing database")
         cls.app = app
+        cls.cache = LRUCache(
+            max_size=app.config["CACHE_MAX_SIZE"],
+            ttl=app.config["CACHE_TTL"],
+            enabled=app.config["CACHE_ENABLED"]
+        )
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in options:
+            # Time how long checkouts wait on the queue pool
+            options.setdefault("poolclass", InstrumentedQueuePool)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
     
+    @classmethod
+    def create_many(cls, records, chunk_size:int=1000):
+        """
+        Creates many Inventory in a single transaction
+
+        Every record is validated with deserialize(), the valid ones are
+        written with one multi-row INSERT per chunk and committed once
+
+        :param records: the Inventory data to create
+        :type records: list of dict
+        :param chunk_size: the number of rows written per INSERT
+        :type chunk_size: int
+
+        :return: the generated ids in input order (None for rejected records)
+            and the errors of the rejected records
+        :rtype: tuple
+
+        """
+        logger.info("Creating %d Inventory in bulk", len(records))
+        ids = [None] * len(records)
+        errors = []
+        rows = []  # (index, values) of every valid record
+        for index, data in enumerate(records):
+            inv = cls()
+            try:
+                inv.deserialize(data)
+            except DataValidationError as error:
+                errors.append({"index": index, "message": str(error)})
+                continue
+            rows.append((index, {
+                "name": inv.name,
+                "condition": inv.condition,
+                "quantity": inv.quantity,
+                "restock_level": inv.restock_level
+            }))
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                for (index, _), new_id in zip(chunk, cls._insert_chunk([values for _, values in chunk])):
+                    ids[index] = new_id
+            db.session.commit()
+            cls.cache.invalidate(*[new_id for new_id in ids if new_id is not None])
+        except Exception:
+            db.session.rollback()
+            raise
+        return ids, errors
+
+    @classmethod
+    def delete_matching(cls, query=None) -> int:
+        """
+        Deletes every Inventory a query matches with a single DELETE
+
+        :param query: a query from one of the finders, or None for all Inventory
+
+        :return: the number of Inventory deleted
+        :rtype: int
+
+        """
+        logger.info("Deleting the Inventory matching a query")
+        if query is None:
+            query = cls.query
+        try:
+            count = query.delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if count:
+            cls.cache.clear()
+        return count
+
+    @classmethod
+    def reset(cls, records, chunk_size:int=1000):
+        """
+        Empties the inventory table and loads it with new records
+
+        PostgreSQL truncates the table, other backends delete every row.
+        The id sequence is not restarted: the workers that did not serve the
+        reset keep cached Inventory until their TTL runs out, and those must
+        not be served under an id that now belongs to another row. The
+        records are then created as by create_many(), in the same transaction
+
+        :param records: the Inventory data to load
+        :type records: list of dict
+        :param chunk_size: the number of rows written per INSERT
+        :type chunk_size: int
+
+        :return: the same ids and errors create_many() returns
+        :rtype: tuple
+
+        """
+        logger.warning("Resetting the inventory table with %d Inventory", len(records))
+        if db.session.get_bind().dialect.name == "postgresql":
+            db.session.execute("TRUNCATE inventory")
+        else:
+            db.session.execute(cls.__table__.delete())
+        result = cls.create_many(records, chunk_size)
+        cls.cache.clear()
+        return result
+
+    @classmethod
+    def _insert_chunk(cls, rows:list) -> list:
+        """
+        Inserts a chunk of rows and returns their ids in the same order
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            # Reserve the ids up front so that a single multi-row INSERT
+            # can be used while still knowing which id belongs to which row
+            new_ids = sorted(row[0] for row in db.session.execute(
+                "SELECT nextval(pg_get_serial_sequence('inventory', 'id')) "
+                "FROM generate_series(1, :count)", {"count": len(rows)}
+            ))
+            for row, new_id in zip(rows, new_ids):
+                row["id"] = new_id
+            db.session.execute(cls.__table__.insert().values(rows))
+            return new_ids
+        # Other backends cannot return generated keys for a multi-row INSERT
+        invs = [cls(**row) for row in rows]
+        db.session.bulk_save_objects(invs, return_defaults=True)
+        return [inv.id for inv in invs]
+
+    @classmethod
+    def update_many(cls, records, chunk_size:int=1000) -> dict:
+        """
+        Replaces many Inventory by id in a single transaction
+
+        Every record is validated with deserialize() and needs the id of an
+        existing Inventory. The valid ones are written with one UPDATE per
+        chunk and committed once; ids that do not exist are reported without
+        failing the others
+
+        :param records: the full Inventory data, each with its id
+        :type records: list of dict
+        :param chunk_size: the number of rows written per UPDATE
+        :type chunk_size: int
+
+        :return: the number of updated Inventory, the ids that were not found
+            and the errors of the rejected records
+        :rtype: dict
+
+        """
+        logger.info("Updating %d Inventory in bulk", len(records))
+        result = {"updated": 0, "missing": [], "errors": []}
+        rows = []
+        seen = set()
+        for index, data in enumerate(records):
+            inv = cls()
+            try:
+                inv.deserialize(data)
+                if not isinstance(inv.id, int) or isinstance(inv.id, bool):
+                    raise DataValidationError("Invalid Inventory record: missing or bad id")
+                if inv.id in seen:
+                    raise DataValidationError("Inventory with id '%d' appears more than once" % inv.id)
+            except DataValidationError as error:
+                result["errors"].append({"index": index, "message": str(error)})
+                continue
+            seen.add(inv.id)
+            rows.append({
+                "id": inv.id,
+                "name": inv.name,
+                "condition": inv.condition,
+                "quantity": inv.quantity,
+                "restock_level": inv.restock_level
+            })
+        updated = []
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                found = cls._update_chunk(chunk)
+                updated.extend(row["id"] for row in chunk if row["id"] in found)
+                result["missing"].extend(row["id"] for row in chunk if row["id"] not in found)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cls.cache.invalidate(*updated)
+        result["updated"] = len(updated)
+        return result
+
+    @classmethod
+    def _update_chunk(cls, rows:list) -> set:
+        """
+        Updates a chunk of rows by id and returns the ids that were found
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            # One UPDATE ... FROM (VALUES ...) RETURNING per chunk. The
+            # VALUES columns are typed by their first row otherwise, so that
+            # a name given as a number in one record and a string in another
+            # would fail the whole request
+            values = ", ".join(
+                "(CAST(:id{0} AS INTEGER), CAST(:name{0} AS VARCHAR), CAST(:condition{0} AS VARCHAR), "
+                "CAST(:quantity{0} AS INTEGER), CAST(:restock_level{0} AS INTEGER))".format(n)
+                for n in range(len(rows))
+            )
+            params = {}
+            for n, row in enumerate(rows):
+                params.update({key + str(n): value for key, value in row.items()})
+                params["condition" + str(n)] = row["condition"].name
+            return {found for found, in db.session.execute(
+                "UPDATE inventory AS i SET name = v.name, condition = CAST(v.condition AS {0}), "
+                "quantity = v.quantity, restock_level = v.restock_level, "
+                "version = nextval('inventory_version_seq') "
+                "FROM (VALUES {1}) AS v (id, name, condition, quantity, restock_level) "
+                "WHERE i.id = v.id RETURNING i.id".format(cls.__table__.c.condition.type.name, values),
+                params
+            )}
+        # Other backends cannot return the matched rows of an executemany
+        found = {row[0] for row in db.session.query(cls.id).filter(
+            cls.id.in_([row["id"] for row in rows]))}
+        updates = [
+            dict({key: value for key, value in row.items() if key != "id"}, inv_id=row["id"])
+            for row in rows if row["id"] in found
+        ]
+        if updates:
+            # The SET clause takes the columns present in the parameters
+            db.session.execute(
+                cls.__table__.update().where(cls.id == bindparam("inv_id")).values(
+                    version=NextVersion()
+                ), updates
+            )
+        return found
+
+    @classmethod
+    def import_records(cls, records, chunk_size:int=1000, max_errors:int=1000) -> dict:
+        """
+        Imports Inventory records in a single transaction
+
+        Every record is validated with deserialize(). Records with an id
+        update that Inventory, the others create a new one; an id may only
+        appear once, its later records are rejected. The records are
+        consumed chunk_size at a time so any number of them can be imported
+        with constant memory. On PostgreSQL the chunks are copied into a
+        staging table and merged at the end, elsewhere every chunk is
+        written with executemany
+
+        :param records: (line, data) pairs of the Inventory to import
+        :type records: iterable of tuple
+        :param chunk_size: the number of records written at a time
+        :type chunk_size: int
+        :param max_errors: the number of rejected records reported in detail
+        :type max_errors: int
+
+        :return: the number of inserted, updated and rejected records and
+            the errors of the first max_errors rejected records
+        :rtype: dict
+
+        """
+        logger.info("Importing Inventory in chunks of %d", chunk_size)
+        result = {"inserted": 0, "updated": 0, "rejected": 0, "errors": []}
+
+        def reject(line, message):
+            result["rejected"] += 1
+            if len(result["errors"]) < max_errors:
+                result["errors"].append({"line": line, "message": message})
+
+        postgres = db.session.get_bind().dialect.name == "postgresql"
+        seen = set()  # ids already updated by an earlier line
+        try:
+            if postgres:
+                cls._create_staging_table()
+            chunk = []
+            for line, data in itertools.chain(records, [(None, None)]):
+                if data is not None:
+                    inv = cls()
+                    try:
+                        inv.deserialize(data)
+                        if inv.id is not None:
+                            if not isinstance(inv.id, int) or isinstance(inv.id, bool):
+                                raise DataValidationError("Invalid Inventory record: bad id")
+                            if inv.id in seen:
+                                raise DataValidationError(
+                                    "Inventory with id '%d' appears more than once" % inv.id)
+                            seen.add(inv.id)
+                    except DataValidationError as error:
+                        reject(line, str(error))
+                        continue
+                    chunk.append({
+                        "line": line,
+                        "id": inv.id,
+                        "name": inv.name,
+                        "condition": inv.condition,
+                        "quantity": inv.quantity,
+                        "restock_level": inv.restock_level
+                    })
+                if chunk and (data is None or len(chunk) >= chunk_size):
+                    if postgres:
+                        cls._copy_to_staging(chunk)
+                    else:
+                        cls._import_chunk(chunk, result, reject)
+                    chunk = []
+            if postgres:
+                cls._merge_staging(result, reject)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if result["updated"]:
+            cls.cache.clear()
+        return result
+
+    @classmethod
+    def _create_staging_table(cls):
+        """
+        Creates the temporary table the PostgreSQL import copies into
+        """
+        db.session.execute(
+            "CREATE TEMP TABLE inventory_import ("
+            "line integer, id integer, name varchar(80), condition varchar(20), "
+            "quantity integer, restock_level integer) ON COMMIT DROP"
+        )
+
+    @classmethod
+    def _copy_to_staging(cls, chunk:list):
+        """
+        Copies a chunk of validated rows into the staging table with COPY
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow([row["line"], row["id"], row["name"], row["condition"].name,
+                row["quantity"], row["restock_level"]])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY inventory_import (line, id, name, condition, quantity, restock_level) "
+                "FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        finally:
+            cursor.close()
+
+    @classmethod
+    def _merge_staging(cls, result:dict, reject):
+        """
+        Merges the staging table into inventory: updates by id, inserts the rest
+        """
+        enum_type = cls.__table__.c.condition.type.name
+        for line, inv_id in db.session.execute(
+            "SELECT s.line, s.id FROM inventory_import s "
+            "WHERE s.id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM inventory i WHERE i.id = s.id) "
+            "ORDER BY s.line"
+        ):
+            reject(line, "Inventory with id '{}' was not found.".format(inv_id))
+        result["updated"] = db.session.execute(
+            "UPDATE inventory AS i SET name = s.name, condition = CAST(s.condition AS {0}), "
+            "quantity = s.quantity, restock_level = s.restock_level, "
+            "version = nextval('inventory_version_seq') "
+            "FROM inventory_import s WHERE s.id = i.id".format(enum_type)
+        ).rowcount
+        result["inserted"] = db.session.execute(
+            "INSERT INTO inventory (name, condition, quantity, restock_level, version) "
+            "SELECT name, CAST(condition AS {0}), quantity, restock_level, "
+            "nextval('inventory_version_seq') "
+            "FROM inventory_import WHERE id IS NULL ORDER BY line".format(enum_type)
+        ).rowcount
+
+    @classmethod
+    def _import_chunk(cls, chunk:list, result:dict, reject):
+        """
+        Writes a chunk of validated rows with executemany
+        """
+        updates = [row for row in chunk if row["id"] is not None]
+        inserts = [row for row in chunk if row["id"] is None]
+        existing = set()
+        if updates:
+            existing = {row[0] for row in db.session.query(cls.id).filter(
+                cls.id.in_([row["id"] for row in updates]))}
+            for row in updates:
+                if row["id"] not in existing:
+                    reject(row["line"], "Inventory with id '{}' was not found.".format(row["id"]))
+        columns = ("name", "condition", "quantity", "restock_level")
+        updates = [
+            dict({key: row[key] for key in columns}, inv_id=row["id"])
+            for row in updates if row["id"] in existing
+        ]
+        if updates:
+            # The SET clause takes the columns present in the parameters
+            db.session.execute(
+                cls.__table__.update().where(cls.id == bindparam("inv_id")).values(
+                    version=NextVersion()
+                ), updates
+            )
+            result["updated"] += len(updates)
+        if inserts:
+            db.session.execute(cls.__table__.insert(), [
+                {key: row[key] for key in columns} for row in inserts
+            ])
+            result["inserted"] += len(inserts)
+
+    @classmethod
+    def replace(cls, id:int, data:dict):
+        """
+        Replaces the fields of an Inventory in a single UPDATE
+
+        The data is validated with deserialize() and written without loading
+        the Inventory first; the updated row comes back with RETURNING
+
+        :param id: the id of the Inventory to replace
+        :type id: int
+        :param data: the new Inventory data, any id in it is ignored
+        :type data: dict
+
+        :return: the serialized Inventory after the update, or None if not found
+        :rtype: dict
+
+        """
+        logger.info("Replacing the Inventory with id %s", id)
+        inv = cls()
+        inv.deserialize(data)
+        statement = cls.__table__.update().where(cls.id == id).values(
+            name=inv.name, condition=inv.condition, quantity=inv.quantity,
+            restock_level=inv.restock_level, version=NextVersion()
+        )
+        row = cls._update_returning(id, statement)
+        db.session.commit()
+        if row is None:
+            return None
+        cls.cache.invalidate(row.id)
+        return cls.serialize_row(row)
+
+    @classmethod
+    def delete_by_id(cls, id:int) -> bool:
+        """
+        Deletes an Inventory in a single DELETE without loading it first
+
+        :param id: the id of the Inventory to delete
+        :type id: int
+
+        :return: True if the Inventory existed
+        :rtype: bool
+
+        """
+        logger.info("Deleting the Inventory with id %s", id)
+        count = db.session.execute(cls.__table__.delete().where(cls.id == id)).rowcount
+        db.session.commit()
+        if count:
+            cls.cache.invalidate(int(id))
+        return count > 0
+
+    @classmethod
+    def increase_stock(cls, id:int, quantity:int):
+        """
+        Adds to the stock of an Inventory in a single UPDATE
+
+        The increase is applied by the database (quantity = quantity + n)
+        so concurrent increases of the same Inventory are never lost
+
+        :param id: the id of the Inventory to increase
+        :type id: int
+        :param quantity: the quantity to add
+        :type quantity: int
+
+        :return: the serialized Inventory after the increase, or None if not found
+        :rtype: dict
+
+        """
+        logger.info("Increasing stock of id %s by %d", id, quantity)
+        statement = cls.__table__.update().where(cls.id == id).values(
+            quantity=cls.quantity + quantity, version=NextVersion()
+        )
+        row = cls._update_returning(id, statement)
+        db.session.commit()
+        if row is None:
+            return None
+        cls.cache.invalidate(row.id)
+        return cls.serialize_row(row)
+
+    @classmethod
+    def decrease_stock(cls, id:int, quantity:int):
+        """
+        Removes from the stock of an Inventory in a single guarded UPDATE
+
+        The UPDATE only matches when quantity >= n, so the check and the
+        decrease happen atomically and no row lock outlives the statement
+
+        :param id: the id of the Inventory to decrease
+        :type id: int
+        :param quantity: the quantity to remove
+        :type quantity: int
+
+        :return: the serialized Inventory after the decrease, or None if not found
+        :rtype: dict
+
+        :raises InsufficientStockError: when the stock is lower than quantity
+
+        """
+        logger.info("Decreasing stock of id %s by %d", id, quantity)
+        statement = cls.__table__.update().where(
+            (cls.id == id) & (cls.quantity >= quantity)
+        ).values(quantity=cls.quantity - quantity, version=NextVersion())
+        row = cls._update_returning(id, statement)
+        if row is None:
+            # Only a failed decrease pays for telling missing from short
+            exists = db.session.query(cls.id).filter(cls.id == id).first()
+            db.session.rollback()
+            if exists:
+                raise InsufficientStockError(
+                    "Inventory with id [%s] has less than [%d] in stock" % (id, quantity)
+                )
+            return None
+        db.session.commit()
+        cls.cache.invalidate(row.id)
+        return cls.serialize_row(row)
+
+    @classmethod
+    def adjust_stock(cls, deltas:dict) -> list:
+        """
+        Applies many stock changes in a single transaction
+
+        The rows are locked in id order first so concurrent batches cannot
+        deadlock, then every change is applied by one UPDATE with a CASE.
+        Either every change is applied or none is
+
+        :param deltas: the quantity to add (or remove when negative) by id
+        :type deltas: dict
+
+        :return: the serialized Inventory after the changes, ordered by id
+        :rtype: list
+
+        :raises DataValidationError: when one of the ids does not exist
+        :raises InsufficientStockError: when a change would make a stock negative
+
+        """
+        logger.info("Adjusting stock of %d Inventory", len(deltas))
+        ids = sorted(deltas)
+        if not ids:
+            return []
+        rows = db.session.execute(
+            cls.__table__.select().where(cls.id.in_(ids)).order_by(cls.id).with_for_update()
+        ).fetchall()
+        missing = sorted(set(ids) - set(row.id for row in rows))
+        if missing:
+            db.session.rollback()
+            raise DataValidationError("Inventory ids not found: %s" % missing)
+        short = [row.id for row in rows if row.quantity + deltas[row.id] < 0]
+        if short:
+            db.session.rollback()
+            raise InsufficientStockError("Inventory ids with not enough stock: %s" % short)
+        db.session.execute(
+            cls.__table__.update().where(cls.id.in_(ids)).values(
+                quantity=cls.quantity + case(deltas, value=cls.id),
+                version=NextVersion()
+            )
+        )
+        db.session.commit()
+        cls.cache.invalidate(*ids)
+        results = []
+        for row in rows:
+            data = cls.serialize_row(row)
+            data["quantity"] += deltas[row.id]
+            results.append(data)
+        return results
+
+    @classmethod
+    def _update_returning(cls, id:int, statement):
+        """
+        Runs an UPDATE of a single Inventory and returns the updated row
+
+        PostgreSQL returns the row with UPDATE ... RETURNING in the same
+        round trip; other backends read it back inside the same transaction
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            return db.session.execute(statement.returning(*cls.__table__.columns)).first()
+        if db.session.execute(statement).rowcount == 0:
+            return None
+        return db.session.execute(
+            cls.__table__.select().where(cls.id == id)
+        ).first()
+
     @classmethod
     def find_all(cls) -> list:
         """
@@ -159,6 +867,126 @@ class Inventory(db.Model):
         logger.info("Processing all Inventory")
         return cls.query.all()
     
+    @classmethod
+    def find_rows(cls, query=None, limit:int=None, after_id:int=None) -> list:
+        """
+        Returns the rows of a listing without building Inventory objects
+
+        The columns are selected through a Core statement, so the rows are
+        plain tuples that never enter the session identity map. Use
+        serialize_rows() to turn them into dictionaries. Pages are read by
+        keyset (WHERE id > after_id ORDER BY id LIMIT n), so the cost of a
+        page does not grow with its position in the table
+
+        :param query: a query from one of the finders, or None for all Inventory
+        :param limit: the maximum number of rows to return, or None for all
+        :type limit: int
+        :param after_id: only return rows with a greater id, ordered by id
+        :type after_id: int
+
+        :return: rows of (id, name, condition, quantity, restock_level, version)
+        :rtype: list
+
+        """
+        logger.info("Processing row query after id %s ...", after_id)
+        return db.session.execute(cls._rows_statement(query, limit, after_id)).fetchall()
+
+    @classmethod
+    def stream_rows(cls, query=None, limit:int=None, after_id:int=None, batch_size:int=1000):
+        """
+        Iterates over the rows of a listing ordered by id without loading them all
+
+        Rows are fetched batch_size at a time through a server-side cursor
+        so memory stays bounded however many rows match
+
+        :param query: a query from one of the finders, or None for all Inventory
+        :param limit: the maximum number of rows to return, or None for all
+        :type limit: int
+        :param after_id: only return rows with a greater id
+        :type after_id: int
+        :param batch_size: the number of rows fetched per round trip
+        :type batch_size: int
+
+        :return: an iterator of lists of rows, as returned by find_rows()
+        :rtype: iterator
+
+        """
+        logger.info("Processing stream query after id %s ...", after_id)
+        statement = cls._rows_statement(cls._page_query(query, limit, after_id))
+        result = db.session.execute(statement.execution_options(stream_results=True))
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+
+    @classmethod
+    def copy_csv(cls, query=None, chunk_size:int=10000):
+        """
+        Iterates over a listing as CSV produced by PostgreSQL's COPY TO STDOUT
+
+        Every chunk is one COPY of the next chunk_size rows by id, so the
+        CSV never has to be held whole in the database connection or here.
+        The columns are the ones serialize() returns, without a header
+
+        :param query: a query from one of the finders, or None for all Inventory
+        :param chunk_size: the number of rows copied at a time
+        :type chunk_size: int
+
+        :return: an iterator of CSV encoded bytes
+        :rtype: iterator
+
+        """
+        logger.info("Processing COPY export in chunks of %d", chunk_size)
+        dialect = db.session.get_bind().dialect
+        if query is None:
+            query = cls.query
+        after_id = None
+        while True:
+            # The last id of the chunk, found from the index alone
+            chunk = cls._page_query(query, chunk_size, after_id).with_entities(cls.id).subquery()
+            last_id = db.session.query(func.max(chunk.c.id)).scalar()
+            if last_id is None:
+                break
+            statement = cls._page_query(query.filter(cls.id <= last_id), None, after_id).with_entities(
+                *[getattr(cls, column) for column in SERIALIZED_COLUMNS]
+            ).statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+            buffer = io.BytesIO()
+            cursor = db.session.connection().connection.cursor()
+            try:
+                cursor.copy_expert("COPY ({}) TO STDOUT WITH (FORMAT csv)".format(statement), buffer)
+            finally:
+                cursor.close()
+            yield buffer.getvalue()
+            after_id = last_id
+
+    @classmethod
+    def _rows_statement(cls, query=None, limit:int=None, after_id:int=None):
+        """
+        Builds the Core SELECT of the columns serialize_rows() expects
+        """
+        if limit is not None or after_id is not None:
+            query = cls._page_query(query, limit, after_id)
+        elif query is None:
+            query = cls.query
+        return query.with_entities(
+            cls.id, cls.name, cls.condition, cls.quantity, cls.restock_level, cls.version
+        ).statement
+
+    @classmethod
+    def _page_query(cls, query, limit:int, after_id:int):
+        """
+        Orders a query by id and restricts it to the rows after after_id
+        """
+        if query is None:
+            query = cls.query
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit)
+
     @classmethod
     def find_by_id(cls, id:int):
         """
@@ -174,6 +1002,166 @@ class Inventory(db.Model):
         logger.info("Processing lookup for id %s ...", id)
         return cls.query.get(id)
     
+    @classmethod
+    def find_cached_by_id(cls, id):
+        """
+        Find a serialized Inventory and its version by it's id through the cache
+
+        Hot Inventory are served from the in-process cache without a
+        database round trip; every write through this model invalidates it.
+        find_by_id stays uncached, it returns an Inventory attached to the
+        session that callers go on to modify, while the cache can only hold
+        detached copies of the data
+
+        :param id: the id of the Inventory to find
+        :type id: int
+
+        :return: the version and the serialized Inventory, or None if not found
+        :rtype: tuple
+
+        """
+        try:
+            key = int(id)
+        except (TypeError, ValueError):
+            return None
+        entry = cls.cache.get(key)
+        if entry is not None:
+            return entry
+        token = cls.cache.token()
+        # A Core SELECT, so an Inventory held by the session is never served stale
+        row = db.session.execute(cls.__table__.select().where(cls.id == key)).first()
+        if row is None:
+            return None
+        entry = (row.version, cls.serialize_row(row))
+        cls.cache.set(key, entry, token)
+        return entry
+
+    @classmethod
+    def summarize(cls, query=None) -> dict:
+        """
+        Computes stock statistics in the database
+
+        One GROUP BY condition query returns every figure, no Inventory
+        object is loaded
+
+        :param query: a query from one of the finders, or None for all Inventory
+
+        :return: the SKU and unit counts overall and by condition, and the
+            count and total shortfall of the Inventory that need restock
+        :rtype: dict
+
+        """
+        logger.info("Processing stats query ...")
+        if query is None:
+            query = cls.query
+        needs_restock = cls.quantity <= cls.restock_level
+        rows = query.with_entities(
+            cls.condition,
+            func.count(cls.id),
+            func.coalesce(func.sum(cls.quantity), 0),
+            func.sum(case([(needs_restock, 1)], else_=0)),
+            func.sum(case([(needs_restock, cls.restock_level - cls.quantity)], else_=0))
+        ).group_by(cls.condition).all()
+        by_condition = {condition.name: {"skus": 0, "units": 0} for condition in Condition}
+        stats = {"skus": 0, "units": 0, "by_condition": by_condition,
+            "need_restock": {"skus": 0, "shortfall": 0}}
+        for condition, skus, units, restock_skus, shortfall in rows:
+            by_condition[condition.name] = {"skus": int(skus), "units": int(units)}
+            stats["skus"] += int(skus)
+            stats["units"] += int(units)
+            stats["need_restock"]["skus"] += int(restock_skus)
+            stats["need_restock"]["shortfall"] += int(shortfall)
+        return stats
+
+    @classmethod
+    def fingerprint(cls, query=None, limit:int=None, after_id:int=None) -> tuple:
+        """
+        Summarizes the rows a listing would return without fetching them
+
+        The count, id sums and version sums change whenever a row of the
+        listing is added, removed or updated, so they make a cheap ETag
+
+        :param query: a query from one of the finders, or None for all Inventory
+        :param limit: the maximum number of Inventory in the listing
+        :type limit: int
+        :param after_id: only consider Inventory with a greater id
+        :type after_id: int
+
+        :return: the same tuple fingerprint_of() returns for those rows
+        :rtype: tuple
+
+        """
+        logger.info("Processing fingerprint query after id %s ...", after_id)
+        rows = cls._page_query(query, limit, after_id).with_entities(
+            cls.id.label("id"), cls.version.label("version")
+        ).subquery()
+        result = db.session.query(
+            func.count(rows.c.id),
+            func.coalesce(func.sum(rows.c.id), 0),
+            func.coalesce(func.sum(rows.c.version), 0),
+            func.coalesce(func.sum(rows.c.id * rows.c.version), 0)
+        ).one()
+        return tuple(int(value) for value in result)
+
+    @staticmethod
+    def fingerprint_of(invs) -> tuple:
+        """
+        Computes the fingerprint() of Inventory that are already loaded
+        """
+        count = id_sum = version_sum = product_sum = 0
+        for inv in invs:
+            count += 1
+            id_sum += inv.id
+            version_sum += inv.version
+            product_sum += inv.id * inv.version
+        return count, id_sum, version_sum, product_sum
+
+    @classmethod
+    def find_by_filters(cls, name:str=None, condition=None, need_restock:bool=None,
+            quantity_min:int=None, quantity_max:int=None, id_min:int=None, id_max:int=None):
+        """
+        Returns all Inventory matching every given filter
+
+        Filters left as None are not applied, so they combine freely
+
+        :param name: the name of the Inventory you want to match
+        :type name: str
+        :param condition: the condition of the Inventory you want to match
+        :type condition: Condition
+        :param need_restock: only Inventory with quantity <= restock_level when True
+        :type need_restock: bool
+        :param quantity_min: the smallest quantity to match
+        :type quantity_min: int
+        :param quantity_max: the largest quantity to match
+        :type quantity_max: int
+        :param id_min: the smallest id to match
+        :type id_min: int
+        :param id_max: the largest id to match
+        :type id_max: int
+
+        :return: a collection of Inventory matching the filters
+        :rtype: list
+
+        """
+        logger.info("Processing filter query name=%s condition=%s need_restock=%s quantity=[%s, %s] id=[%s, %s] ...",
+            name, condition, need_restock, quantity_min, quantity_max, id_min, id_max)
+        query = cls.query
+        if name:  # an empty name filters nothing, as it always has
+            query = query.filter(cls.name == name)
+        if condition is not None:
+            query = query.filter(cls.condition == condition)
+        if need_restock:
+            query = query.filter(cls.quantity <= cls.restock_level)
+        if quantity_min is not None:
+            query = query.filter(cls.quantity >= quantity_min)
+        if quantity_max is not None:
+            query = query.filter(cls.quantity <= quantity_max)
+        if id_min is not None:
+            query = query.filter(cls.id >= id_min)
+        if id_max is not None:
+            query = query.filter(cls.id <= id_max)
+        return query
+
     @classmethod
     def find_by_name(cls, name:str) -> list:
         """
@@ -201,6 +1189,30 @@ class Inventory(db.Model):
         logger.info("Processing restock query ...")
         return cls.query.filter(cls.quantity <= cls.restock_level)
 
+    @classmethod
+    def sort_by_shortfall(cls, query=None, weighted:bool=False):
+        """
+        Orders Inventory by how far their quantity is below their restock level
+
+        The most urgent come first and ties are broken by id once a page is
+        taken with limit. Unweighted and together with need_restock the order
+        is read from a partial expression index, so the top K cost the same
+        at any size; the weighted order is sorted
+
+        :param query: a query from one of the finders, or None for all Inventory
+        :param weighted: multiply the shortfall by the SHORTFALL_WEIGHTS of the condition
+        :type weighted: bool
+
+        :return: the query ordered by shortfall
+        :rtype: Query
+
+        """
+        logger.info("Processing shortfall sort weighted=%s ...", weighted)
+        if query is None:
+            query = cls.query
+        condition = cls.condition if weighted else None
+        return query.order_by(shortfall_of(cls.quantity, cls.restock_level, condition).desc())
+
     @classmethod
     def find_by_condition(cls, condition) -> list:
         """
@@ -215,3 +1227,27 @@ class Inventory(db.Model):
         """
         logger.info("Processing condition query for %s ...", condition.name)
         return cls.query.filter(cls.condition == condition)
+
+# PostgreSQL draws the versions of inserted rows from the sequence too
+event.listen(Inventory.__table__, "after_create", DDL(
+    "ALTER TABLE inventory ALTER COLUMN version SET DEFAULT nextval('inventory_version_seq')"
+).execute_if(dialect="postgresql"))
+
+# SQLite has no sequences: the version counter is a one-row table and
+# triggers stamp every inserted or updated row with its next value
+_STAMP_VERSION = (
+    "BEGIN "
+    "UPDATE inventory_version_seq SET value = value + 1; "
+    "UPDATE inventory SET version = (SELECT value FROM inventory_version_seq) WHERE id = NEW.id; "
+    "END"
+)
+for _ddl in (
+    "CREATE TABLE IF NOT EXISTS inventory_version_seq (value INTEGER NOT NULL)",
+    "INSERT INTO inventory_version_seq (value) "
+    "SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM inventory_version_seq)",
+    "CREATE TRIGGER inventory_version_insert AFTER INSERT ON inventory " + _STAMP_VERSION,
+    # Not fired by the version-only UPDATE of the triggers themselves
+    "CREATE TRIGGER inventory_version_update "
+    "AFTER UPDATE OF name, condition, quantity, restock_level ON inventory " + _STAMP_VERSION,
+):
+    event.listen(Inventory.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
@@ -0,0 +1,116 @@
+"""
+Connection pool telemetry for the Inventory Service
+
+Pool events of every engine feed one PoolStats per worker process, and
+InstrumentedQueuePool times how long each checkout waits for a connection.
+The numbers are meant for sizing pool_size and max_overflow per worker.
+"""
+import os
+import time
+import threading
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool, QueuePool
+
+
+class PoolStats:
+    """Counters of the connection pools of this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.connects = 0
+            self.closes = 0
+            self.invalidations = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def incr(self, counter: str):
+        """Adds one to a counter"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds: float):
+        """Records how long a checkout waited for a connection"""
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self, pool: Pool) -> dict:
+        """Returns the counters together with the current state of pool"""
+        with self._lock:
+            data = {
+                "pid": os.getpid(),
+                "pool": type(pool).__name__,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "checkout_wait": {
+                    "count": self.wait_count,
+                    "total_ms": round(self.wait_total * 1000, 3),
+                    "avg_ms": round(self.wait_total * 1000 / self.wait_count, 3) if self.wait_count else 0.0,
+                    "max_ms": round(self.wait_max * 1000, 3),
+                },
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            })
+        return data
+
+
+stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long every checkout waits"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            stats.incr("timeouts")
+            raise
+        finally:
+            stats.record_wait(time.perf_counter() - start)
+
+
+@event.listens_for(Pool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    stats.incr("connects")
+
+
+@event.listens_for(Pool, "close")
+def _on_close(dbapi_connection, connection_record):
+    stats.incr("closes")
+
+
+@event.listens_for(Pool, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    stats.incr("invalidations")
+
+
+@event.listens_for(Pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    stats.incr("checkouts")
+
+
+@event.listens_for(Pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    stats.incr("checkins")
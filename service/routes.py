@@ -3,11 +3,25 @@ Inventory Service
 
 Paths:
 ------
-GET /inventory - returns a list all of the inventory
+GET /inventory - returns a list all of the inventory, one page at a time with ?limit=
+GET /inventory?need_restock=true&sort=shortfall&limit=K - returns the K inventory most in need of restock
 GET /inventory/{id} - returns the inventory with a given id number
+DELETE /inventory - deletes the inventory matching the filters in one statement
 POST /inventory - creates a new inventory in the database
+PUT /inventory - updates many inventory by id in one transaction
 PUT /inventory/{id} - updates a inventory with a given id number 
 DELETE /inventory/{id} - deletes a inventory with a given id number 
+PUT /inventory/{id}/increase - increases the stock of a inventory
+PUT /inventory/{id}/decrease - decreases the stock of a inventory if there is enough
+POST /inventory/bulk - creates many inventory in one transaction
+POST /inventory/import - creates and updates inventory from a CSV file
+GET /inventory/export - streams the inventory matching the filters as a CSV or NDJSON file
+POST /inventory/adjustments - changes the stock of many inventory in one transaction
+GET /inventory/stats - returns stock statistics of the inventory matching the filters
+POST /internal/reset - truncates the inventory and loads the posted inventory, if ALLOW_RESET
+GET /internal/cache - returns the counters of the inventory cache
+GET /internal/pool - returns the state and counters of the database connection pool
+GET /metrics - returns request, database, cache and pool metrics in the Prometheus text format
 """
 
 # import os
@@ -15,8 +29,21 @@ DELETE /inventory/{id} - deletes a inventory with a given id number
 # import logging
 # from typing_extensions import Required
 # from flask import Flask, jsonify, request, url_for, make_response, abort
+import io
+import csv
+import json
+import time
+import zlib
+import base64
+import itertools
+import codecs
+import orjson
+from flask import request, Response, stream_with_context
+from werkzeug.http import quote_etag
 from . import status, app  # HTTP Status Codes and Flask App
-from service.models import Inventory, Condition
+from service.models import Inventory, Condition, DataValidationError, SERIALIZED_COLUMNS, db
+from service import pool, metrics
+from service.metrics import query_budget, set_query_budget
 from flask_restx import Api, Resource, fields, reqparse, inputs
 # from werkzeug.exceptions import NotFound, BadRequest
 
@@ -41,6 +68,16 @@ def index():
     # )
     return app.send_static_file("index.html")
 
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """ Metrics of every worker in the Prometheus text format """
+    app.extensions["metrics"].flush()  # the SQL totals this worker has not added yet
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
@@ -92,14 +129,120 @@ increase_model = api.model(
     }
 )
 
+# Decrease Inventory Model
+decrease_model = api.model(
+    'Decrease Inventory Model',
+    {
+    'remove_stock': fields.Integer(
+        required=True,
+        description='The quantity to remove from the Inventory'),
+    }
+)
+
+# Stock adjustment model
+adjustment_model = api.model(
+    'Stock Adjustment Model',
+    {
+    'id': fields.Integer(
+        required=True,
+        description='The id of the Inventory to adjust'),
+    'delta': fields.Integer(
+        required=True,
+        description='The quantity to add, negative to remove'),
+    }
+)
+
+# Bulk create result model
+bulk_error_model = api.model('Bulk Error Model', {
+    'index': fields.Integer(
+        description='The position of the rejected record in the request'),
+    'message': fields.String(
+        description='Why the record was rejected'),
+})
+
+delete_result_model = api.model('Delete Result Model', {
+    'deleted': fields.Integer(description='The number of Inventory deleted'),
+})
+
+bulk_result_model = api.model('Bulk Result Model', {
+    'ids': fields.List(fields.Integer,
+        description='The generated ids in input order, null for rejected records'),
+    'errors': fields.List(fields.Nested(bulk_error_model),
+        description='The records that were rejected'),
+})
+
+bulk_update_result_model = api.model('Bulk Update Result Model', {
+    'updated': fields.Integer(description='The number of Inventory updated'),
+    'missing': fields.List(fields.Integer,
+        description='The ids of the records that match no Inventory'),
+    'errors': fields.List(fields.Nested(bulk_error_model),
+        description='The records that were rejected'),
+})
+
+import_error_model = api.model('Import Error Model', {
+    'line': fields.Integer(
+        description='The line of the rejected row in the CSV file'),
+    'message': fields.String(
+        description='Why the row was rejected'),
+})
+
+import_result_model = api.model('Import Result Model', {
+    'inserted': fields.Integer(description='The number of Inventory created'),
+    'updated': fields.Integer(description='The number of Inventory updated by id'),
+    'rejected': fields.Integer(description='The number of rows rejected'),
+    'errors': fields.List(fields.Nested(import_error_model),
+        description='The first rejected rows, up to IMPORT_MAX_ERRORS'),
+    'seconds': fields.Float(description='How long the import took'),
+    'rows_per_second': fields.Float(description='The rows processed per second'),
+})
+
 # Possible URL args
-inv_args = reqparse.RequestParser()
-inv_args.add_argument('name', type=str, 
+# Filters shared by every endpoint that works on a filtered set of Inventory
+filter_args = reqparse.RequestParser()
+filter_args.add_argument('name', type=str, 
     required=False, help='List Inventory by name')
-inv_args.add_argument('condition', type=str, 
+filter_args.add_argument('condition', type=str, choices=Condition._member_names_,
     required=False, help='List Inventory by condition')
-inv_args.add_argument('need_restock', type=inputs.boolean, 
+filter_args.add_argument('need_restock', type=inputs.boolean, 
     required=False, help='List Inventory by whether it needs restock')
+filter_args.add_argument('quantity_min', type=inputs.natural,
+    required=False, help='List Inventory with at least this quantity')
+filter_args.add_argument('quantity_max', type=inputs.natural,
+    required=False, help='List Inventory with at most this quantity')
+filter_args.add_argument('id_min', type=inputs.natural,
+    required=False, help='List Inventory with at least this id')
+filter_args.add_argument('id_max', type=inputs.natural,
+    required=False, help='List Inventory with at most this id')
+
+inv_args = filter_args.copy()
+inv_args.add_argument('limit', type=inputs.int_range(1, app.config["MAX_PAGE_SIZE"]),
+    required=False, help='Maximum number of Inventory per page')
+inv_args.add_argument('after_id', type=inputs.natural,
+    required=False, help='List Inventory with an id greater than this one')
+inv_args.add_argument('cursor', type=str,
+    required=False, help='Opaque cursor taken from the next link of the previous page')
+inv_args.add_argument('stream', type=inputs.boolean,
+    required=False, help='Stream the Inventory as newline delimited JSON')
+inv_args.add_argument('sort', type=str, choices=("id", "shortfall", "weighted_shortfall"),
+    default="id", required=False,
+    help='Order by id, or most urgent restock first, optionally weighted by condition')
+
+# Arguments of the filtered delete, which needs a filter or all=true
+delete_args = filter_args.copy()
+delete_args.add_argument('all', type=inputs.boolean, default=False,
+    required=False, help='Delete every Inventory when no filter is given')
+
+# Arguments of the export, which takes the same filters as the list
+export_args = filter_args.copy()
+export_args.add_argument('format', type=str, choices=("csv", "ndjson"), default="csv",
+    required=False, help='Export as CSV with a header row or as newline delimited JSON')
+export_args.add_argument('gzip', type=inputs.boolean, default=False,
+    required=False, help='Compress the export with gzip')
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
+CONTENT_TYPE_CSV = "text/csv"
+CONTENT_TYPE_GZIP = "application/gzip"
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
@@ -109,6 +252,178 @@ def abort(error_code: int, message: str):
     app.logger.error(message)
     api.abort(error_code, message)
 
+def encode_cursor(after_id: int) -> str:
+    """Encodes the position of a page into an opaque cursor"""
+    data = json.dumps({"after_id": after_id}).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """Decodes a cursor made by encode_cursor into the id to continue after"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        after_id = data["after_id"]
+    except (ValueError, TypeError, KeyError):
+        after_id = None
+    if not isinstance(after_id, int):
+        abort(status.HTTP_400_BAD_REQUEST, "Cursor '{}' is invalid.".format(cursor))
+    return after_id
+
+def next_page_link(resource, after_id: int) -> str:
+    """Builds a Link header pointing at the page following after_id"""
+    params = {key: value for key, value in request.args.items() if key not in ("after_id", "cursor")}
+    params["cursor"] = encode_cursor(after_id)
+    return '<{}>; rel="next"'.format(api.url_for(resource, _external=True, **params))
+
+def filter_query(args):
+    """Builds the query of the Inventory matching the filter_args"""
+    condition = getattr(Condition, args['condition']) if args['condition'] else None
+    return Inventory.find_by_filters(
+        name=args['name'],
+        condition=condition,
+        need_restock=args['need_restock'],
+        quantity_min=args['quantity_min'],
+        quantity_max=args['quantity_max'],
+        id_min=args['id_min'],
+        id_max=args['id_max']
+    )
+
+def has_filters(args) -> bool:
+    """Tells whether the filter_args restrict the Inventory at all"""
+    return bool(args['need_restock']) or bool(args['name']) or any(
+        args[arg.name] is not None for arg in filter_args.args if arg.name not in ('need_restock', 'name')
+    )
+
+def bulk_insert_budget(count: int) -> int:
+    """The statements create_many() runs to insert count Inventory"""
+    if db.session.get_bind().dialect.name == "postgresql":
+        # Reserving the ids and the INSERT of every chunk
+        return 2 * -(-count // app.config["BULK_CHUNK_SIZE"])
+    return count  # one INSERT per row
+
+def bulk_update_budget(count: int) -> int:
+    """The statements update_many() runs to update count Inventory"""
+    chunks = -(-count // app.config["BULK_CHUNK_SIZE"])
+    if db.session.get_bind().dialect.name == "postgresql":
+        return chunks  # one UPDATE ... RETURNING per chunk
+    return 2 * chunks  # finding the ids and the executemany of every chunk
+
+def read_bulk_payload():
+    """
+    Parses the body of a bulk request, a JSON array or application/x-ndjson
+
+    Returns the parsed records with their position, and the errors of the
+    lines that are not valid JSON
+    """
+    if request.mimetype == CONTENT_TYPE_NDJSON:
+        return read_ndjson(request.get_data(as_text=True).splitlines())
+    payload = request.get_json()
+    if not isinstance(payload, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Bulk payload must be a JSON array.")
+    return list(enumerate(payload)), []
+
+def json_response(data, code: int = status.HTTP_200_OK, headers: dict = None) -> Response:
+    """
+    Encodes data straight into a JSON response
+
+    The Inventory endpoints return already serialized dictionaries, so the
+    flask-restx models only document them and are not used to marshal them
+    """
+    return Response(orjson.dumps(data), status=code, headers=headers, mimetype=CONTENT_TYPE_JSON)
+
+def not_modified(etag: str):
+    """Builds a 304 response when the client already has this ETag"""
+    if request.if_none_match.contains(etag):
+        app.logger.info("Returning 304 for ETag %s", etag)
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+    return None
+
+def collection_etag(fingerprint: tuple) -> str:
+    """Formats a listing fingerprint as an ETag"""
+    return "-".join("%x" % value for value in fingerprint)
+
+def wants_ndjson(args) -> bool:
+    """Tells whether the client asked for a newline delimited JSON stream"""
+    if args['stream']:
+        return True
+    best = request.accept_mimetypes.best_match([CONTENT_TYPE_JSON, CONTENT_TYPE_NDJSON])
+    return best == CONTENT_TYPE_NDJSON
+
+def generate_ndjson(batches):
+    """Serializes batches of Inventory rows into newline delimited JSON, one chunk per batch"""
+    for rows in batches:
+        yield b"\n".join(orjson.dumps(data) for data in Inventory.serialize_rows(rows)) + b"\n"
+
+def generate_csv(batches):
+    """Serializes batches of Inventory rows into CSV lines, one chunk per batch"""
+    for rows in batches:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(
+            [data[column] for column in SERIALIZED_COLUMNS] for data in Inventory.serialize_rows(rows)
+        )
+        yield buffer.getvalue().encode()
+
+def generate_gzip(chunks):
+    """Compresses chunks into one gzip stream as they are produced"""
+    compressor = zlib.compressobj(wbits=31)  # 31 writes the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def read_ndjson(lines):
+    """
+    Parses newline delimited JSON
+
+    Returns the parsed records with their position, and the errors
+    of the lines that are not valid JSON. Blank lines are skipped
+    """
+    records, errors = [], []
+    for index, line in enumerate(line for line in lines if line.strip()):
+        try:
+            records.append((index, json.loads(line)))
+        except ValueError as error:
+            errors.append({"index": index, "message": "Invalid JSON: " + str(error)})
+    return records, errors
+
+def read_csv(file):
+    """
+    Parses a CSV file with a header row into (line, record) pairs
+
+    The file is read one row at a time. id, quantity and restock_level
+    are turned into integers when they are numbers so that deserialize()
+    judges them like JSON values, and empty or missing columns are left
+    out so that deserialize() reports them as missing
+    """
+    reader = csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+    try:
+        for record in reader:
+            data = {}
+            for key, value in record.items():
+                if key is None or value is None or value.strip() == "":
+                    continue
+                value = value.strip()
+                if key in ("id", "quantity", "restock_level"):
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        pass
+                data[key] = value
+            yield reader.line_num, data
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise DataValidationError("Invalid CSV near line {}: {}".format(reader.line_num + 1, error))
+
+def import_csv(file) -> dict:
+    """Imports the Inventory of a CSV file and adds the rate to the result"""
+    start = time.perf_counter()
+    result = Inventory.import_records(
+        read_csv(file), app.config["BULK_CHUNK_SIZE"], app.config["IMPORT_MAX_ERRORS"]
+    )
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    rows = result["inserted"] + result["updated"] + result["rejected"]
+    result["rows_per_second"] = round(rows / result["seconds"], 1) if result["seconds"] else float(rows)
+    return result
+
 ######################################################################
 #  PATH: /inventory
 ######################################################################
@@ -119,7 +434,8 @@ class InvCollection(Resource):
 
     POST /inventory - Returns a Inventory with the id
     GET /Inventory - Returns a list of Inventory
-    DELETE /inventory/{id} - deletes a inventory with a given id number 
+    PUT /inventory - updates many Inventory by id
+    DELETE /inventory - deletes the Inventory matching the filters
     """
     #------------------------------------------------------------------
     # CREATE A NEW INVENTORY
@@ -127,7 +443,8 @@ class InvCollection(Resource):
     @api.doc('create_inventory')
     @api.response(400, 'The posted data was not valid')
     @api.expect(inv_request_model)
-    @api.marshal_with(inventory_model, code=201)
+    @api.response(201, 'Inventory created', inventory_model)
+    @query_budget(1)
     def post(self):
         """
         Creates a single Inventory
@@ -144,39 +461,118 @@ class InvCollection(Resource):
         # since this url is going to be used to access the resource from outside
         app.logger.info("Inventory with ID [%s] created.", inv.id)
         # Only returns JSON
-        return inv.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(inv.serialize(), status.HTTP_201_CREATED, {"Location": location_url})
     
     #------------------------------------------------------------------
     # LIST ALL INVENTORY
     #------------------------------------------------------------------
     @api.doc('list_inventory')
     @api.expect(inv_args, validate=True) # expect inv args and validate them
-    @api.marshal_list_with(inventory_model)
+    @api.response(200, 'Success', [inventory_model])
+    @api.response(304, 'Inventory list not modified')
+    @query_budget(2)
     def get(self):
         """ 
         Returns all of the Inventory with matching query
         
-        This endpoint will list Inventory based the query option in the args
+        This endpoint will list Inventory matching every filter in the args.
+        Send Accept: application/x-ndjson or ?stream=true to stream the rows.
+        With sort=shortfall it returns the limit most urgent to restock
         """
         app.logger.info("Request for inventory list")
-        invs = []
         args = inv_args.parse_args()
-        if args['name']:
-            app.logger.info('Filtering by name: %s', args['name'])
-            invs = Inventory.find_by_name(args['name'])
-        elif args['condition']:
-            app.logger.info('Filtering by condition: %s', args['name'])
-            condition_enum = getattr(Condition, args['condition'])
-            invs = Inventory.find_by_condition(condition_enum)
-        elif args['need_restock']==True:
-            app.logger.info('Filtering by need restock')
-            invs = Inventory.find_by_need_restock()
+        after_id = args['after_id']
+        if args['cursor']:
+            after_id = decode_cursor(args['cursor'])
+        query = filter_query(args)
+        by_id = args['sort'] == 'id'
+        if not by_id:
+            if after_id is not None:
+                abort(status.HTTP_400_BAD_REQUEST, "Only sort=id pages with after_id or a cursor.")
+            query = Inventory.sort_by_shortfall(query, weighted=args['sort'] == 'weighted_shortfall')
+        if wants_ndjson(args):
+            app.logger.info("Streaming invs")
+            batch_size = app.config["STREAM_BATCH_SIZE"]
+            batches = Inventory.stream_rows(query, args['limit'], after_id, batch_size)
+            return Response(
+                stream_with_context(generate_ndjson(batches)),
+                status=status.HTTP_200_OK,
+                mimetype=CONTENT_TYPE_NDJSON
+            )
+        limit = args['limit']
+        if limit is None and (after_id is not None or not by_id):
+            limit = app.config["MAX_PAGE_SIZE"]
+        if request.if_none_match:
+            # Answer conditional requests before loading any row
+            etag = collection_etag(Inventory.fingerprint(query, limit, after_id))
+            response = not_modified(etag)
+            if response:
+                return response
+        headers = {}
+        if limit is None:
+            rows = Inventory.find_rows(query)
         else:
-            app.logger.info('Filtering by all')
-            invs = Inventory.find_all()
-        results = [inv.serialize() for inv in invs]
+            # Fetch one extra row to know whether there is a next page
+            rows = Inventory.find_rows(query, limit + 1, after_id)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                if by_id:
+                    headers["Link"] = next_page_link(InvCollection, rows[-1].id)
+        headers["ETag"] = quote_etag(collection_etag(Inventory.fingerprint_of(rows)))
+        results = Inventory.serialize_rows(rows)
         app.logger.info("Returning %d invs", len(results))
-        return results, status.HTTP_200_OK
+        return json_response(results, status.HTTP_200_OK, headers)
+
+    #------------------------------------------------------------------
+    # UPDATE MANY INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('update_inventory_bulk')
+    @api.response(400, 'The posted data was not valid')
+    @api.expect([inventory_model])
+    @api.response(200, 'Inventory updated', bulk_update_result_model)
+    @query_budget(1)
+    def put(self):
+        """
+        Updates many Inventory
+
+        This endpoint accepts a JSON array or an application/x-ndjson body of
+        full Inventory with their ids and updates them in a single
+        transaction. Ids that match no Inventory are listed as missing
+        """
+        app.logger.info("Request to update inventory in bulk")
+        parsed, errors = read_bulk_payload()
+        records = [record for _, record in parsed]
+        set_query_budget(bulk_update_budget(len(records)))
+        result = Inventory.update_many(records, app.config["BULK_CHUNK_SIZE"])
+        for error in result["errors"]:
+            error["index"] = parsed[error["index"]][0]
+        result["errors"] = sorted(errors + result["errors"], key=lambda error: error["index"])
+        app.logger.info("Updated %d inventory in bulk, %d missing, rejected %d",
+            result["updated"], len(result["missing"]), len(result["errors"]))
+        return json_response(result)
+
+    #------------------------------------------------------------------
+    # DELETE THE INVENTORY MATCHING THE FILTERS
+    #------------------------------------------------------------------
+    @api.doc('delete_inventory_matching')
+    @api.expect(delete_args, validate=True)
+    @api.response(400, 'Neither a filter nor all=true was given')
+    @api.response(200, 'Inventory deleted', delete_result_model)
+    @query_budget(1)
+    def delete(self):
+        """
+        Deletes the Inventory matching the filters
+
+        This endpoint takes the filters of the list and deletes every matching
+        Inventory with a single DELETE. Without filters it needs all=true
+        """
+        args = delete_args.parse_args()
+        app.logger.info("Request to delete inventory matching %s", args)
+        if not has_filters(args) and not args['all']:
+            abort(status.HTTP_400_BAD_REQUEST, "Give a filter, or all=true to delete every inventory.")
+        count = Inventory.delete_matching(filter_query(args))
+        app.logger.info("Deleted %d inventory", count)
+        return json_response({"deleted": count})
 
 ######################################################################
 #  PATH: /inventory/{id}
@@ -198,7 +594,9 @@ class InvResource(Resource):
     #------------------------------------------------------------------
     @api.doc('get_inventory') 
     @api.response(404, 'Inventory not found') 
-    @api.marshal_with(inventory_model)
+    @api.response(304, 'Inventory not modified')
+    @api.response(200, 'Success', inventory_model)
+    @query_budget(1)
     def get(self, inv_id):
         """
         Retrieve a single Inventory
@@ -206,26 +604,27 @@ class InvResource(Resource):
         This endpoint will return an Inventory based on it's id
         """
         app.logger.info("Request to Retrieve an Inventory with id [%s]", inv_id)
-        inv = Inventory.find_by_id(inv_id)
-        if not inv:
+        found = Inventory.find_cached_by_id(inv_id)
+        if not found:
             abort(status.HTTP_404_NOT_FOUND, "Inventory with id '{}' was not found.".format(inv_id))
-        return inv.serialize(), status.HTTP_200_OK
+        version, inv = found
+        etag = "{}-{}".format(inv["id"], version)
+        return not_modified(etag) or json_response(inv, status.HTTP_200_OK, {"ETag": quote_etag(etag)})
 
     #------------------------------------------------------------------
     # DELETE AN INVENTORY
     #------------------------------------------------------------------
     @api.doc('delete_inventory')
     @api.response(204, 'Inventory deleted')
+    @query_budget(1)
     def delete(self, inv_id):
         """
         Delete a Inventory
         This endpoint will delete a Inventory based the id specified in the path
         """
-        app.logger.info("Request to delete the inventory with key {}".format(inv_id))
-        inventory = Inventory.find_by_id(inv_id)
-        if inventory:
-            inventory.delete()
-            app.logger.info("Inventory with id {} deleted".format(inv_id))
+        app.logger.info("Request to delete the inventory with key %s", inv_id)
+        if Inventory.delete_by_id(inv_id):
+            app.logger.info("Inventory with id %s deleted", inv_id)
         return '', status.HTTP_204_NO_CONTENT
 
     #------------------------------------------------------------------
@@ -235,7 +634,8 @@ class InvResource(Resource):
     @api.response(404, 'Inventory not found')
     @api.response(400, 'Inventory data invalid')
     @api.expect(inv_request_model)
-    @api.marshal_with(inventory_model)
+    @api.response(200, 'Success', inventory_model)
+    @query_budget(2)  # one on PostgreSQL, others read the row back
     def put(self, inv_id):
         """
         Update an Inventory
@@ -243,15 +643,12 @@ class InvResource(Resource):
         This endpoint will update an Inventory based the body that is posted
         """
         app.logger.info('Request to Update an Inventory with id [%s]', inv_id)
-        inv = Inventory.find_by_id(inv_id)
+        app.logger.debug('Payload = %s', api.payload)
+        inv = Inventory.replace(inv_id, api.payload)
         if not inv:
             abort(status.HTTP_404_NOT_FOUND, "Inventory with id '{}' was not found.".format(inv_id))
-        app.logger.debug('Payload = %s', api.payload)
-        inv.deserialize(api.payload)
-        inv.id = inv_id
-        inv.update()
-        app.logger.info("Inventory with ID [%s] updated.", inv.id)
-        return inv.serialize(), status.HTTP_200_OK
+        app.logger.info("Inventory with ID [%s] updated.", inv_id)
+        return json_response(inv)
 
 ######################################################################
 #  PATH: /inventory/{id}/increase
@@ -270,7 +667,8 @@ class AddStockResource(Resource): # action
     @api.response(404, 'Inventory not found')
     @api.response(400, 'Invalid quantity value')
     @api.expect(increase_model, validate=True)
-    @api.marshal_with(inventory_model)
+    @api.response(200, 'Success', inventory_model)
+    @query_budget(2)
     def put(self, inv_id):
         """
         Increase inventory stock
@@ -278,17 +676,349 @@ class AddStockResource(Resource): # action
         This endpoint will increase inventory stocks
         """
         quantity = api.payload["add_stock"]
-        app.logger.info('Request to increases inventory [{}] stock by [{}]'.format(inv_id, quantity))
+        app.logger.info('Request to increases inventory [%s] stock by [%s]', inv_id, quantity)
 
-        inv = Inventory.find_by_id(inv_id)
+        if (quantity < 0):
+            abort(status.HTTP_400_BAD_REQUEST, 'Quantity with value [{}] is invalid.'.format(quantity))
+
+        inv = Inventory.increase_stock(inv_id, quantity)
         if not inv:
             abort(status.HTTP_404_NOT_FOUND, 'Inventory with id [{}] was not found.'.format(inv_id))
-        
+
+        app.logger.info('Inventory with id [%s] stock increased successfully', inv_id)
+        return json_response(inv)
+
+######################################################################
+#  PATH: /inventory/{id}/decrease
+######################################################################
+@api.route('/inventory/<inv_id>/decrease')
+@api.param('inv_id', 'The Inventory ID')
+class RemoveStockResource(Resource): # action
+    """ 
+    Decrease actions on an Inventory 
+    """
+
+    #------------------------------------------------------------------
+    # DECREASE AN INVENTORY STOCK
+    #------------------------------------------------------------------
+    @api.doc('decrease_inventory')
+    @api.response(404, 'Inventory not found')
+    @api.response(400, 'Invalid quantity value')
+    @api.response(409, 'Not enough stock')
+    @api.expect(decrease_model, validate=True)
+    @api.response(200, 'Success', inventory_model)
+    @query_budget(2)
+    def put(self, inv_id):
+        """
+        Decrease inventory stock
+
+        This endpoint will decrease inventory stocks, or return 409 when
+        the stock is lower than the quantity to remove
+        """
+        quantity = api.payload["remove_stock"]
+        app.logger.info('Request to decrease inventory [%s] stock by [%s]', inv_id, quantity)
+
         if (quantity < 0):
             abort(status.HTTP_400_BAD_REQUEST, 'Quantity with value [{}] is invalid.'.format(quantity))
 
-        inv.quantity += quantity
-        inv.update()
+        inv = Inventory.decrease_stock(inv_id, quantity)
+        if not inv:
+            abort(status.HTTP_404_NOT_FOUND, 'Inventory with id [{}] was not found.'.format(inv_id))
+
+        app.logger.info('Inventory with id [%s] stock decreased successfully', inv_id)
+        return json_response(inv)
+
+######################################################################
+#  PATH: /inventory/stats
+######################################################################
+@api.route('/inventory/stats')
+class InvStatsResource(Resource):
+    """
+    Aggregate statistics of a collection of Inventory
+    """
+
+    #------------------------------------------------------------------
+    # RETRIEVE INVENTORY STATISTICS
+    #------------------------------------------------------------------
+    @api.doc('get_inventory_stats')
+    @api.expect(filter_args, validate=True)
+    @query_budget(1)
+    def get(self):
+        """
+        Retrieve inventory statistics
+
+        This endpoint returns the SKU and unit counts, overall and by
+        condition, and how many SKUs need restock and by how much. It
+        accepts the same filters as the list endpoint
+        """
+        app.logger.info("Request for inventory stats")
+        args = filter_args.parse_args()
+        return Inventory.summarize(filter_query(args)), status.HTTP_200_OK
+
+######################################################################
+#  PATH: /inventory/bulk
+######################################################################
+@api.route('/inventory/bulk')
+class InvBulkResource(Resource):
+    """
+    Handles creating many Inventory in one request
+
+    POST /inventory/bulk - Creates a list of Inventory in one transaction
+    """
 
-        app.logger.info('Inventory with id [{}] stock increased successfully'.format(inv_id))
-        return inv.serialize(), status.HTTP_200_OK
+    #------------------------------------------------------------------
+    # CREATE MANY INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('create_inventory_bulk')
+    @api.response(400, 'The posted data was not valid')
+    @api.expect([inv_request_model])
+    @api.response(201, 'Inventory created', bulk_result_model)
+    @query_budget(2)
+    def post(self):
+        """
+        Creates many Inventory
+
+        This endpoint accepts a JSON array or an application/x-ndjson body
+        and creates every valid Inventory in a single transaction
+        """
+        app.logger.info("Request to create inventory in bulk")
+        parsed, errors = read_bulk_payload()
+        records = [record for _, record in parsed]
+        set_query_budget(bulk_insert_budget(len(records)))
+        new_ids, row_errors = Inventory.create_many(records, app.config["BULK_CHUNK_SIZE"])
+        # Map the positions of the parsed records back to the request
+        ids = [None] * (len(parsed) + len(errors))
+        for (index, _), new_id in zip(parsed, new_ids):
+            ids[index] = new_id
+        for error in row_errors:
+            error["index"] = parsed[error["index"]][0]
+        errors = sorted(errors + row_errors, key=lambda error: error["index"])
+        app.logger.info("Created %d inventory in bulk, rejected %d", len(records) - len(row_errors), len(errors))
+        return json_response({"ids": ids, "errors": errors}, status.HTTP_201_CREATED)
+
+######################################################################
+#  PATH: /inventory/export
+######################################################################
+@api.route('/inventory/export')
+class InvExportResource(Resource):
+    """
+    Exports Inventory as a file
+
+    GET /inventory/export - streams the Inventory matching the filters as CSV or NDJSON
+    """
+
+    #------------------------------------------------------------------
+    # EXPORT INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('export_inventory')
+    @api.expect(export_args, validate=True)
+    @api.response(200, 'The Inventory as a CSV or NDJSON file')
+    @query_budget(0)  # every statement runs while the response streams
+    def get(self):
+        """
+        Exports the Inventory matching the filters
+
+        This endpoint streams every matching Inventory ordered by id through a
+        server-side cursor, as CSV with a header row or as NDJSON, optionally
+        compressed with gzip. On PostgreSQL the CSV is produced by COPY
+        """
+        args = export_args.parse_args()
+        app.logger.info("Request to export inventory as %s", args["format"])
+        query = filter_query(args)
+        batch_size = app.config["STREAM_BATCH_SIZE"]
+        if args["format"] == "ndjson":
+            mimetype, chunks = CONTENT_TYPE_NDJSON, generate_ndjson(
+                Inventory.stream_rows(query, batch_size=batch_size))
+        else:
+            mimetype = CONTENT_TYPE_CSV
+            if db.session.get_bind().dialect.name == "postgresql":
+                chunks = Inventory.copy_csv(query, app.config["EXPORT_CHUNK_SIZE"])
+            else:
+                chunks = generate_csv(Inventory.stream_rows(query, batch_size=batch_size))
+            chunks = itertools.chain([(",".join(SERIALIZED_COLUMNS) + "\n").encode()], chunks)
+        filename = "inventory." + args["format"]
+        if args["gzip"]:
+            mimetype, chunks, filename = CONTENT_TYPE_GZIP, generate_gzip(chunks), filename + ".gz"
+        return Response(
+            stream_with_context(chunks),
+            status=status.HTTP_200_OK,
+            mimetype=mimetype,
+            headers={"Content-Disposition": "attachment; filename=" + filename}
+        )
+
+######################################################################
+#  PATH: /inventory/import
+######################################################################
+@api.route('/inventory/import')
+class InvImportResource(Resource):
+    """
+    Imports Inventory from CSV files
+
+    POST /inventory/import - creates and updates Inventory from a CSV file
+    """
+
+    #------------------------------------------------------------------
+    # IMPORT INVENTORY FROM CSV
+    #------------------------------------------------------------------
+    @api.doc('import_inventory')
+    @api.response(400, 'The CSV file could not be read')
+    @api.response(415, 'The body is neither text/csv nor a multipart upload')
+    @api.response(200, 'Inventory imported', import_result_model)
+    @query_budget(4)
+    def post(self):
+        """
+        Imports Inventory from a CSV file
+
+        This endpoint accepts a text/csv body, or a multipart/form-data upload
+        in a field named file, with a header row of name, condition, quantity,
+        restock_level and optionally id. Rows with an id update that Inventory
+        and the others are created, all in a single transaction. Invalid rows
+        are reported by line and skipped
+        """
+        app.logger.info("Request to import inventory")
+        if request.mimetype == "multipart/form-data":
+            upload = request.files.get("file")
+            if upload is None:
+                abort(status.HTTP_400_BAD_REQUEST, "Upload the CSV file in a field named file.")
+            file = upload.stream
+        elif request.mimetype == CONTENT_TYPE_CSV:
+            file = request.stream
+        else:
+            abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                "Content-Type must be {} or multipart/form-data".format(CONTENT_TYPE_CSV))
+        result = import_csv(file)
+        if db.session.get_bind().dialect.name != "postgresql":
+            # A lookup of the ids, an UPDATE and an INSERT for every chunk
+            rows = result["inserted"] + result["updated"] + result["rejected"]
+            set_query_budget(3 * -(-rows // app.config["BULK_CHUNK_SIZE"]))
+        app.logger.info("Imported %d inventory and updated %d, rejected %d at %s rows/s",
+            result["inserted"], result["updated"], result["rejected"], result["rows_per_second"])
+        return json_response(result)
+
+######################################################################
+#  PATH: /inventory/adjustments
+######################################################################
+@api.route('/inventory/adjustments')
+class AdjustmentsResource(Resource): # action
+    """
+    Stock changes on many Inventory at once
+
+    POST /inventory/adjustments - Applies a list of stock changes all or nothing
+    """
+
+    #------------------------------------------------------------------
+    # ADJUST THE STOCK OF MANY INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('adjust_inventory')
+    @api.response(400, 'The posted data was not valid or an id was not found')
+    @api.response(409, 'Not enough stock')
+    @api.expect([adjustment_model])
+    @api.response(200, 'Success', [inventory_model])
+    @query_budget(2)
+    def post(self):
+        """
+        Adjust the stock of many Inventory
+
+        This endpoint applies every {id, delta} pair in one transaction,
+        either all of them succeed or none does
+        """
+        app.logger.info("Request to adjust inventory stock")
+        payload = request.get_json()
+        if not isinstance(payload, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Adjustments payload must be a JSON array.")
+        deltas = {}
+        for adjustment in payload:
+            try:
+                inv_id, delta = adjustment["id"], adjustment["delta"]
+            except (KeyError, TypeError):
+                abort(status.HTTP_400_BAD_REQUEST, "Adjustment [{}] needs an id and a delta.".format(adjustment))
+            # JSON true and false are ints to Python, but they are no id or delta
+            if not all(isinstance(value, int) and not isinstance(value, bool) for value in (inv_id, delta)):
+                abort(status.HTTP_400_BAD_REQUEST, "Adjustment [{}] is invalid.".format(adjustment))
+            deltas[inv_id] = deltas.get(inv_id, 0) + delta
+        results = Inventory.adjust_stock(deltas)
+        app.logger.info("Adjusted the stock of %d inventory", len(results))
+        return json_response(results)
+
+######################################################################
+#  PATH: /internal/reset
+######################################################################
+@api.route('/internal/reset')
+class ResetResource(Resource):
+    """
+    Truncates and reseeds the inventory table, for test and staging setups
+    """
+
+    #------------------------------------------------------------------
+    # TRUNCATE AND RESEED THE INVENTORY
+    #------------------------------------------------------------------
+    @api.doc('reset_inventory')
+    @api.expect([inv_request_model])
+    @api.response(403, 'Reset is disabled by ALLOW_RESET')
+    @api.response(200, 'Inventory reset', bulk_result_model)
+    @query_budget(1)
+    def post(self):
+        """
+        Replaces every Inventory with the posted ones
+
+        This endpoint empties the inventory table with TRUNCATE and loads the
+        JSON array in the body like the bulk create; the new Inventory get
+        new ids. It only works when ALLOW_RESET is set
+        """
+        app.logger.warning("Request to reset the inventory")
+        if not app.config["ALLOW_RESET"]:
+            abort(status.HTTP_403_FORBIDDEN, "Reset is disabled, set ALLOW_RESET to enable it.")
+        records = request.get_json(silent=True) if request.get_data() else []
+        if not isinstance(records, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Reset payload must be a JSON array.")
+        set_query_budget(1 + bulk_insert_budget(len(records)))
+        ids, errors = Inventory.reset(records, app.config["BULK_CHUNK_SIZE"])
+        app.logger.warning("Reset the inventory with %d inventory", len(records) - len(errors))
+        return json_response({"ids": ids, "errors": errors})
+
+######################################################################
+#  PATH: /internal/cache
+######################################################################
+@api.route('/internal/cache')
+class CacheStatsResource(Resource):
+    """
+    Telemetry of the in-process Inventory cache of this worker
+    """
+
+    #------------------------------------------------------------------
+    # RETRIEVE THE CACHE COUNTERS
+    #------------------------------------------------------------------
+    @api.doc('get_cache_stats')
+    @query_budget(0)
+    def get(self):
+        """
+        Retrieve the cache counters
+
+        This endpoint returns the size, hits, misses and evictions of the
+        Inventory cache of the worker that serves the request
+        """
+        return Inventory.cache.stats(), status.HTTP_200_OK
+
+######################################################################
+#  PATH: /internal/pool
+######################################################################
+@api.route('/internal/pool')
+class PoolStatsResource(Resource):
+    """
+    Telemetry of the database connection pool of this worker
+    """
+
+    #------------------------------------------------------------------
+    # RETRIEVE THE POOL COUNTERS
+    #------------------------------------------------------------------
+    @api.doc('get_pool_stats')
+    @query_budget(0)
+    def get(self):
+        """
+        Retrieve the connection pool counters
+
+        This endpoint returns the checked out, idle and overflow connections,
+        the checkout wait times and the connection churn of the worker that
+        serves the request
+        """
+        return pool.stats.snapshot(db.engine.pool), status.HTTP_200_OK
@@ -21,3 +21,18 @@ class InventoryFactory(factory.Factory):
     condition = FuzzyChoice(
         choices=[Condition.new, Condition.used, Condition.slightly_used, Condition.unknown]
     )
+
+
+def inventory_records(count: int, distinct: int = 1000) -> list:
+    """
+    Returns count serialized fake Inventory without ids, for loading large tables
+
+    Only distinct of them are built by InventoryFactory, the rest repeat them,
+    so a million records take seconds instead of minutes
+    """
+    built = []
+    for inv in InventoryFactory.build_batch(min(count, distinct)):
+        data = inv.serialize()
+        del data["id"]
+        built.append(data)
+    return [built[index % len(built)] for index in range(count)]
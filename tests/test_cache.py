@@ -0,0 +1,88 @@
+"""
+Test cases for the in-process LRU cache
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+
+"""
+import unittest
+from service.cache import LRUCache
+
+
+class FakeClock:
+    """A clock the tests can move forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """Test Cases for LRUCache"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.clock = FakeClock()
+        self.cache = LRUCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        """Counts hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "one")
+        self.assertEqual(self.cache.get(1), "one")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """Evicts the least recently used entry when full"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.get(3), "three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expires_after_ttl(self):
+        """Entries expire after the TTL"""
+        self.cache.set(1, "one")
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get(1), "one")
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        """Invalidated entries are gone"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "two")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_stale_token_is_ignored(self):
+        """A value read before an invalidation is not cached"""
+        token = self.cache.token()
+        self.cache.invalidate(1)
+        self.cache.set(1, "stale", token)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "fresh", self.cache.token())
+        self.assertEqual(self.cache.get(1), "fresh")
+
+    def test_disabled(self):
+        """A disabled cache never stores anything"""
+        cache = LRUCache(enabled=False)
+        cache.set(1, "one")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["misses"], 0)
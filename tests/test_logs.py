@@ -0,0 +1,95 @@
+"""
+Test cases for the queued JSON logging pipeline
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+
+"""
+import json
+import logging
+import unittest
+from service.logs import JsonFormatter, SamplingFilter, init_logging
+
+
+class ListHandler(logging.Handler):
+    """A handler that keeps the formatted lines"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class CountingArg:
+    """A log argument that counts how often it is turned into a string"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "counted"
+
+
+######################################################################
+#  L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogs(unittest.TestCase):
+    """Test Cases for the logging pipeline"""
+
+    def setUp(self):
+        """This runs before each test"""
+        logging.disable(logging.NOTSET)
+        self.logger = logging.getLogger("tests.logs")
+        self.logger.propagate = False
+        self.handler = ListHandler()
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.logger.handlers = []
+        logging.disable(logging.CRITICAL)
+
+    def test_json_lines(self):
+        """Records are written as JSON with their arguments applied"""
+        listener = init_logging([self.logger], [self.handler], logging.INFO, {})
+        self.logger.info("Inventory %s has %d units", "widget", 3)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("Failed")
+        listener.stop()
+        first, second = [json.loads(line) for line in self.handler.lines]
+        self.assertEqual(first["message"], "Inventory widget has 3 units")
+        self.assertEqual(first["level"], "INFO")
+        self.assertEqual(first["logger"], "tests.logs")
+        self.assertIn("ValueError: boom", second["exception"])
+
+    def test_formatting_is_deferred(self):
+        """Arguments are formatted by the listener, not by the caller"""
+        listener = init_logging([self.logger], [self.handler], logging.INFO, {})
+        listener.stop()  # nothing is written until the listener runs again
+        arg = CountingArg()
+        self.logger.info("Deferred %s", arg)
+        self.assertEqual(arg.calls, 0)
+        listener.start()
+        listener.stop()
+        self.assertEqual(arg.calls, 1)
+        self.assertEqual(json.loads(self.handler.lines[0])["message"], "Deferred counted")
+
+    def test_sampling(self):
+        """Sampled levels keep one in 1/rate records, others keep all"""
+        sampling = SamplingFilter({logging.INFO: 0.25, logging.DEBUG: 0.0})
+        record = lambda level: logging.LogRecord("tests", level, __file__, 1, "line", None, None)
+        self.assertEqual(sum(sampling.filter(record(logging.INFO)) for _ in range(100)), 25)
+        self.assertEqual(sum(sampling.filter(record(logging.DEBUG)) for _ in range(100)), 0)
+        self.assertEqual(sum(sampling.filter(record(logging.WARNING)) for _ in range(100)), 100)
+
+    def test_formatter_without_exception(self):
+        """Plain records have no exception key"""
+        record = logging.LogRecord("tests", logging.WARNING, __file__, 1, "%s", ("plain",), None)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "plain")
+        self.assertNotIn("exception", data)
@@ -9,9 +9,10 @@ Test cases can be run with:
 # from datetime import date
 # import os
 import logging
+import itertools
 import unittest
 # from werkzeug.exceptions import NotFound
-from service.models import Condition, Inventory, DataValidationError, db
+from service.models import Condition, Inventory, DataValidationError, InsufficientStockError, db
 from service import app
 from .factories import InventoryFactory
 
@@ -41,6 +42,7 @@ class TestInventoryModel(unittest.TestCase):
         """This runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
+        Inventory.cache.clear()  # rows were dropped behind its back
 
     def tearDown(self):
         """This runs after each test"""
@@ -301,4 +303,355 @@ class TestInventoryModel(unittest.TestCase):
         
         result = Inventory.find_by_condition(Condition.unknown) # Query
         invs_list = [inv for inv in result] # Convert to list
-        self.assertEqual(len(invs_list), 1) # Should get 1 item back
\ No newline at end of file
+        self.assertEqual(len(invs_list), 1) # Should get 1 item back
+
+    def test_create_many(self):
+        """Create many Inventory in one transaction"""
+        records = [inv.serialize() for inv in InventoryFactory.build_batch(5)]
+        records[2]["quantity"] = -1 # Bad value
+        ids, errors = Inventory.create_many(records, chunk_size=2)
+        self.assertEqual(len(ids), 5)
+        self.assertIsNone(ids[2])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["index"], 2)
+        self.assertEqual(len(Inventory.find_all()), 4)
+        for record, new_id in zip(records, ids):
+            if new_id is None:
+                continue
+            inv = Inventory.find_by_id(new_id)
+            self.assertEqual(inv.name, record["name"])
+            self.assertEqual(inv.quantity, record["quantity"])
+            self.assertEqual(inv.restock_level, record["restock_level"])
+            self.assertEqual(inv.condition.name, record["condition"])
+
+    def test_update_many(self):
+        """Update many Inventory by id in one transaction"""
+        invs = InventoryFactory.create_batch(3)
+        for inv in invs:
+            inv.create()
+        versions = {inv.id: inv.version for inv in invs}
+        records = [inv.serialize() for inv in InventoryFactory.build_batch(4)]
+        for record, inv in zip(records, invs):
+            record["id"] = inv.id
+        records[1]["restock_level"] = -1 # Bad value
+        records[3]["id"] = invs[-1].id + 100
+        result = Inventory.update_many(records, chunk_size=2)
+        self.assertEqual(result["updated"], 2)
+        self.assertEqual(result["missing"], [invs[-1].id + 100])
+        self.assertEqual([error["index"] for error in result["errors"]], [1])
+        for record in (records[0], records[2]):
+            inv = Inventory.find_by_id(record["id"])
+            self.assertEqual(inv.serialize(), record)
+            self.assertGreater(inv.version, versions[inv.id])
+
+    def test_import_records(self):
+        """Import creates new Inventory and updates existing ones by id"""
+        inv = InventoryFactory()
+        inv.create()
+        inv_id, version = inv.id, inv.version
+        records = [inv.serialize() for inv in InventoryFactory.build_batch(4)]
+        for record in records:
+            del record["id"]
+        records[1]["quantity"] = -1 # Bad value
+        records.append({"id": inv_id, "name": "imported", "condition": "used", "quantity": 7, "restock_level": 1})
+        records.append({"id": inv_id + 1000, "name": "ghost", "condition": "new", "quantity": 1, "restock_level": 0})
+        result = Inventory.import_records(
+            [(line, record) for line, record in enumerate(records, start=2)], chunk_size=2
+        )
+        self.assertEqual(result["inserted"], 3)
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(result["rejected"], 2)
+        self.assertEqual([error["line"] for error in result["errors"]], [3, 7])
+        self.assertIn("not found", result["errors"][1]["message"])
+        self.assertEqual(len(Inventory.find_all()), 4)
+        inv = Inventory.find_by_id(inv_id)
+        self.assertEqual(inv.name, "imported")
+        self.assertEqual(inv.condition, Condition.used)
+        self.assertEqual(inv.quantity, 7)
+        self.assertGreater(inv.version, version)
+        self.assertEqual(sorted(inv.name for inv in Inventory.find_all() if inv.id != inv_id),
+            sorted(record["name"] for record in records[:4] if record["quantity"] >= 0))
+
+    def test_import_records_limits_errors(self):
+        """Only the first max_errors rejected records are reported in detail"""
+        records = [(line, {"name": "bad"}) for line in range(10)]
+        result = Inventory.import_records(records, max_errors=3)
+        self.assertEqual(result["rejected"], 10)
+        self.assertEqual(len(result["errors"]), 3)
+        self.assertEqual(result["inserted"], 0)
+
+    def test_import_records_rejects_duplicates(self):
+        """An id imported twice and an over-long name are rejected by line"""
+        inv = InventoryFactory()
+        inv.create()
+        data = {"id": inv.id, "condition": "new", "quantity": 1, "restock_level": 0}
+        records = [
+            (2, dict(data, name="first")),
+            (3, dict(data, name="second")),
+            (4, {"name": "x" * 81, "condition": "new", "quantity": 1, "restock_level": 0}),
+            (5, dict(data, id="abc", name="bad id")),
+        ]
+        result = Inventory.import_records(records)
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(result["inserted"], 0)
+        self.assertEqual([error["line"] for error in result["errors"]], [3, 4, 5])
+        self.assertIn("more than once", result["errors"][0]["message"])
+        self.assertIn("longer than 80", result["errors"][1]["message"])
+        self.assertEqual([found.id for found in Inventory.find_by_name("first")], [inv.id])
+
+    def test_create_many_keeps_ids_unique(self):
+        """Bulk created ids do not collide with single creates"""
+        inv = InventoryFactory()
+        inv.create()
+        records = [inv.serialize() for inv in InventoryFactory.build_batch(3)]
+        ids, errors = Inventory.create_many(records)
+        self.assertEqual(errors, [])
+        self.assertNotIn(inv.id, ids)
+        self.assertEqual(len(set(ids)), 3)
+        inv = InventoryFactory()
+        inv.create()
+        self.assertNotIn(inv.id, ids)
+
+    def test_find_rows_paginated(self):
+        """Returns rows one page at a time ordered by id"""
+        invs = InventoryFactory.create_batch(5)
+        for inv in invs:
+            inv.create()
+        ids = sorted(inv.id for inv in invs)
+        page = Inventory.find_rows(limit=2)
+        self.assertEqual([row.id for row in page], ids[:2])
+        page = Inventory.find_rows(limit=2, after_id=page[-1].id)
+        self.assertEqual([row.id for row in page], ids[2:4])
+        page = Inventory.find_rows(Inventory.find_by_need_restock(), limit=10, after_id=ids[3])
+        self.assertEqual([row.id for row in page], [inv.id for inv in invs if inv.id > ids[3] and inv.quantity <= inv.restock_level])
+
+    def test_find_rows(self):
+        """Returns plain rows that stay out of the session"""
+        invs = InventoryFactory.create_batch(5)
+        for inv in invs:
+            inv.create()
+        ids = sorted(inv.id for inv in invs)
+        db.session.expunge_all()
+        rows = Inventory.find_rows()
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertEqual(sorted(row.id for row in rows), ids)
+        self.assertEqual(sorted(Inventory.serialize_rows(rows), key=lambda data: data["id"]),
+            sorted((inv.serialize() for inv in Inventory.find_all()), key=lambda data: data["id"]))
+        db.session.expunge_all()
+        rows = Inventory.find_rows(Inventory.find_by_need_restock(), limit=10, after_id=ids[1])
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertEqual([row.id for row in rows],
+            sorted(inv.id for inv in Inventory.find_by_need_restock() if inv.id > ids[1]))
+        self.assertEqual(Inventory.fingerprint_of(Inventory.find_rows(limit=2)),
+            Inventory.fingerprint(limit=2))
+
+    def test_stream_rows(self):
+        """Streams rows in batches ordered by id"""
+        invs = InventoryFactory.create_batch(5)
+        for inv in invs:
+            inv.create()
+        ids = sorted(inv.id for inv in invs)
+        db.session.expunge_all()
+        batches = list(Inventory.stream_rows(batch_size=2))
+        self.assertEqual([len(rows) for rows in batches], [2, 2, 1])
+        self.assertEqual([row.id for rows in batches for row in rows], ids)
+        self.assertEqual(len(db.session.identity_map), 0)
+        batches = list(Inventory.stream_rows(limit=3, after_id=ids[0], batch_size=10))
+        self.assertEqual([row.id for row in batches[0]], ids[1:4])
+
+    def test_increase_stock(self):
+        """Increase the stock of an Inventory in place"""
+        inv = InventoryFactory()
+        inv.create()
+        quantity = inv.quantity
+        data = Inventory.increase_stock(inv.id, 7)
+        self.assertEqual(data["id"], inv.id)
+        self.assertEqual(data["quantity"], quantity + 7)
+        self.assertEqual(data["name"], inv.name)
+        self.assertEqual(data["condition"], inv.condition.name)
+        self.assertEqual(Inventory.find_by_id(inv.id).quantity, data["quantity"])
+
+    def test_increase_stock_not_found(self):
+        """Increase the stock of an Inventory that does not exist"""
+        self.assertIsNone(Inventory.increase_stock(0, 7))
+
+    def test_find_by_id_after_update(self):
+        """Updates made without the ORM are seen by a loaded Inventory"""
+        inv = InventoryFactory(quantity=1)
+        inv.create()
+        self.assertEqual(Inventory.find_by_id(inv.id).quantity, 1)
+        Inventory.increase_stock(inv.id, 10)
+        self.assertEqual(Inventory.find_by_id(inv.id).quantity, 11)
+        Inventory.update_many([dict(inv.serialize(), quantity=5)])
+        self.assertEqual(Inventory.find_by_id(inv.id).quantity, 5)
+
+    def test_decrease_stock(self):
+        """Decrease the stock of an Inventory only when there is enough"""
+        inv = InventoryFactory()
+        inv.quantity = 10
+        inv.create()
+        data = Inventory.decrease_stock(inv.id, 4)
+        self.assertEqual(data["quantity"], 6)
+        self.assertRaises(InsufficientStockError, Inventory.decrease_stock, inv.id, 7)
+        self.assertEqual(Inventory.find_by_id(inv.id).quantity, 6)
+        self.assertIsNone(Inventory.decrease_stock(0, 1))
+
+    def test_replace(self):
+        """Replace the fields of an Inventory without loading it"""
+        inv = InventoryFactory()
+        inv.create()
+        version = inv.version
+        data = InventoryFactory().serialize()
+        result = Inventory.replace(inv.id, data)
+        self.assertEqual(result["id"], inv.id)
+        self.assertEqual(result["name"], data["name"])
+        self.assertEqual(result["quantity"], data["quantity"])
+        found = Inventory.find_by_id(inv.id)
+        self.assertEqual(found.restock_level, data["restock_level"])
+        self.assertGreater(found.version, version)
+        self.assertIsNone(Inventory.replace(0, data))
+        data["quantity"] = -1
+        self.assertRaises(DataValidationError, Inventory.replace, inv.id, data)
+
+    def test_delete_by_id(self):
+        """Delete an Inventory without loading it"""
+        inv = InventoryFactory()
+        inv.create()
+        inv_id = inv.id
+        self.assertTrue(Inventory.delete_by_id(inv_id))
+        self.assertFalse(Inventory.delete_by_id(inv_id))
+        self.assertEqual(Inventory.find_all(), [])
+
+    def test_update_bumps_version(self):
+        """Every kind of update gives a new, greater version"""
+        inv = InventoryFactory()
+        inv.create()
+        versions = [inv.version]
+        inv.quantity = 1
+        inv.update()
+        versions.append(inv.version)
+        for update in (lambda: Inventory.increase_stock(inv.id, 1),
+                lambda: Inventory.decrease_stock(inv.id, 1),
+                lambda: Inventory.adjust_stock({inv.id: 1})):
+            update()
+            versions.append(Inventory.find_by_id(inv.id).version)
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_versions_are_never_reused(self):
+        """An Inventory that takes over a deleted id starts from a new version"""
+        invs = InventoryFactory.create_batch(2)
+        for inv in invs:
+            inv.create()
+        deleted = (invs[1].id, invs[1].version)
+        invs[1].delete()
+        inv = InventoryFactory()
+        inv.create()
+        self.assertNotEqual((inv.id, inv.version), deleted)
+        self.assertGreater(inv.version, deleted[1])
+
+    def test_fingerprint(self):
+        """The fingerprint from the database matches the loaded rows"""
+        invs = InventoryFactory.create_batch(4)
+        for inv in invs:
+            inv.create()
+        invs[0].name = "DevOps"
+        invs[0].update()
+        self.assertEqual(Inventory.fingerprint(), Inventory.fingerprint_of(Inventory.find_all()))
+        query = Inventory.find_by_name("DevOps")
+        self.assertEqual(Inventory.fingerprint(query), Inventory.fingerprint_of(query.all()))
+        self.assertEqual(Inventory.fingerprint(limit=2, after_id=invs[0].id),
+            Inventory.fingerprint_of(Inventory.find_rows(limit=2, after_id=invs[0].id)))
+
+    def test_find_by_filters(self):
+        """Returns the Inventory matching every filter"""
+        invs = InventoryFactory.create_batch(10)
+        for i, inv in enumerate(invs):
+            inv.name = "DevOps" if i % 2 else "Agile"
+            inv.condition = Condition.new if i % 3 else Condition.used
+            inv.quantity = i * 10
+            inv.restock_level = 45
+            inv.create()
+        result = Inventory.find_by_filters(
+            name="DevOps", condition=Condition.new, need_restock=True, quantity_min=10
+        ).all()
+        expected = [inv.id for inv in invs if inv.name == "DevOps" and inv.condition == Condition.new
+            and inv.quantity <= 45 and inv.quantity >= 10]
+        self.assertEqual(sorted(inv.id for inv in result), sorted(expected))
+        result = Inventory.find_by_filters(quantity_min=20, quantity_max=50).all()
+        self.assertEqual(sorted(inv.quantity for inv in result), [20, 30, 40, 50])
+        self.assertEqual(len(Inventory.find_by_filters().all()), 10)
+        self.assertEqual(len(Inventory.find_by_filters(name="").all()), 10)
+
+    def test_delete_matching(self):
+        """Deletes the Inventory a query matches"""
+        invs = InventoryFactory.create_batch(5)
+        for inv in invs:
+            inv.create()
+        ids = [inv.id for inv in invs]
+        query = Inventory.find_by_filters(id_min=ids[1], id_max=ids[3])
+        self.assertEqual(Inventory.delete_matching(query), 3)
+        self.assertEqual(sorted(inv.id for inv in Inventory.find_all()), [ids[0], ids[4]])
+        self.assertEqual(Inventory.delete_matching(), 2)
+        self.assertEqual(Inventory.find_all(), [])
+
+    def test_reset(self):
+        """Replaces every Inventory with new records"""
+        for inv in InventoryFactory.create_batch(3):
+            inv.create()
+        records = [inv.serialize() for inv in InventoryFactory.build_batch(2)]
+        ids, errors = Inventory.reset(records)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(inv.id for inv in Inventory.find_all()), sorted(ids))
+
+    def test_sort_by_shortfall(self):
+        """Orders Inventory by shortfall, optionally weighted by condition"""
+        shapes = [(5, 10, Condition.used), (0, 10, Condition.used), (8, 10, Condition.new),
+            (2, 10, Condition.unknown), (10, 10, Condition.new), (20, 10, Condition.new)]
+        invs = []
+        for quantity, restock_level, condition in shapes:
+            inv = InventoryFactory(quantity=quantity, restock_level=restock_level, condition=condition)
+            inv.create()
+            invs.append(inv.id)
+        query = Inventory.find_by_filters(need_restock=True)
+        rows = Inventory.find_rows(Inventory.sort_by_shortfall(query), limit=3)
+        self.assertEqual([row.id for row in rows], [invs[1], invs[3], invs[0]])
+        # 10 * 2 (used), 5 * 2 (used), then 2 * 4 (new) and 8 * 1 (unknown) tied by id
+        rows = Inventory.find_rows(Inventory.sort_by_shortfall(query, weighted=True), limit=4)
+        self.assertEqual([row.id for row in rows], [invs[1], invs[0], invs[2], invs[3]])
+        rows = Inventory.find_rows(Inventory.sort_by_shortfall(), limit=10)
+        self.assertEqual(rows[-1].id, invs[5])
+
+    def _explain(self, query) -> str:
+        """Returns the query plan of a query"""
+        sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        if db.engine.dialect.name == "postgresql":
+            # The test tables are tiny, make sure an index is picked if it can be
+            db.session.execute("SET LOCAL enable_seqscan = off")
+            rows = db.session.execute("EXPLAIN " + sql)
+            plan = "\n".join(row[0] for row in rows)
+        else:
+            rows = db.session.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = "\n".join(row[-1] for row in rows)
+        db.session.rollback()
+        return plan
+
+    def test_filters_use_indexes(self):
+        """Every combination of list filters is served by an index"""
+        Inventory.create_many([inv.serialize() for inv in InventoryFactory.build_batch(50)])
+        filters = {"name": "fan", "condition": Condition.new, "need_restock": True}
+        for count in range(1, len(filters) + 1):
+            for names in itertools.combinations(filters, count):
+                for quantity in ({}, {"quantity_min": 10, "quantity_max": 500}):
+                    kwargs = dict(quantity, **{name: filters[name] for name in names})
+                    query = Inventory.find_by_filters(**kwargs).order_by(Inventory.id)
+                    plan = self._explain(query)
+                    self.assertIn("ix_inventory_", plan, "%s: %s" % (kwargs, plan))
+
+    def test_shortfall_sort_uses_index(self):
+        """The top K by shortfall are read in order from an index"""
+        Inventory.create_many([inv.serialize() for inv in InventoryFactory.build_batch(50)])
+        query = Inventory.sort_by_shortfall(Inventory.find_by_need_restock())
+        plan = self._explain(Inventory._page_query(query, 10, None))
+        self.assertIn("ix_inventory_shortfall", plan)
+        self.assertNotIn("Sort", plan)  # PostgreSQL
+        self.assertNotIn("TEMP B-TREE", plan)  # SQLite
@@ -8,14 +8,23 @@ Test cases can be run with the following:
 
 """
 
-# import os
+import io
+import os
+import csv
+import gzip
+import json
+import tempfile
 import logging
 import unittest
 
+from unittest.mock import patch
 from urllib.parse import quote_plus
+from sqlalchemy import event
 from service import status  # HTTP Status Codes
-from service.models import db, init_db
-from service import app
+from service.models import db, init_db, Inventory, Condition
+from service import app, routes, metrics
+from service.metrics import QueryBudgetExceeded
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram
 from .factories import InventoryFactory
 
 from config import DATABASE_URI
@@ -26,6 +35,7 @@ logging.disable(logging.CRITICAL)
 
 BASE_URL = "/api/inventory"
 CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
 
 ######################################################################
 #  T E S T   C A S E S
@@ -52,6 +62,7 @@ class TestInventoryServer(unittest.TestCase):
 		"""Runs before each test"""
 		db.drop_all()  # clean up the last tests
 		db.create_all()  # create new tables
+		Inventory.cache.clear()  # rows were dropped behind its back
 		self.app = app.test_client()
 
 	def tearDown(self):
@@ -77,6 +88,20 @@ class TestInventoryServer(unittest.TestCase):
 			invs.append(test_inv)
 		return invs
 	
+	def _count_statements(self, method, *args, **kwargs):
+		"""
+		Sends a request and returns its response and the SQL statements it ran
+		"""
+		statements = []
+		def count(conn, cursor, statement, parameters, context, executemany):
+			statements.append(statement)
+		event.listen(db.engine, "before_cursor_execute", count)
+		try:
+			resp = getattr(self.app, method)(*args, **kwargs)
+		finally:
+			event.remove(db.engine, "before_cursor_execute", count)
+		return resp, statements
+
 	def test_index(self):
 		"""Test the Home Page"""
 		resp = self.app.get("/")
@@ -97,6 +122,87 @@ class TestInventoryServer(unittest.TestCase):
 		self.assertEqual(data["condition"], test_inv.condition.name)
 		self.assertEqual(data["restock_level"], test_inv.restock_level)
 
+	def test_get_inventory_cached(self):
+		"""Repeated lookups are served from the cache and see writes"""
+		test_inv = self._create_invs(1)[0]
+		url = BASE_URL + "/{}".format(test_inv.id)
+		hits = Inventory.cache.stats()["hits"]
+		self.app.get(url)
+		resp = self.app.get(url)
+		self.assertEqual(resp.get_json()["quantity"], test_inv.quantity)
+		self.assertEqual(Inventory.cache.stats()["hits"], hits + 1)
+		self.app.put(url + "/increase", json={"add_stock": 5}, content_type=CONTENT_TYPE_JSON)
+		resp = self.app.get(url)
+		self.assertEqual(resp.get_json()["quantity"], test_inv.quantity + 5)
+		self.app.delete(url)
+		resp = self.app.get(url)
+		self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+		resp = self.app.get("/api/internal/cache")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertIn("evictions", resp.get_json())
+
+	def test_get_inventory_etag(self):
+		"""Conditional GET of a single Inventory"""
+		test_inv = self._create_invs(1)[0]
+		url = BASE_URL + "/{}".format(test_inv.id)
+		resp = self.app.get(url)
+		etag = resp.headers.get("ETag")
+		self.assertIsNotNone(etag)
+		resp = self.app.get(url, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assertEqual(len(resp.data), 0)
+		self.app.put(url + "/increase", json={"add_stock": 1}, content_type=CONTENT_TYPE_JSON)
+		resp = self.app.get(url, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(resp.headers.get("ETag"), etag)
+
+	def test_get_inv_list_etag(self):
+		"""Conditional GET of the Inventory list"""
+		invs = self._create_invs(3)
+		resp = self.app.get(BASE_URL)
+		etag = resp.headers.get("ETag")
+		self.assertIsNotNone(etag)
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		# Every kind of write changes the ETag
+		data = invs[0].serialize()
+		data["name"] = "renamed"
+		self.app.put(BASE_URL + "/{}".format(invs[0].id), json=data, content_type=CONTENT_TYPE_JSON)
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		etag = resp.headers.get("ETag")
+		self.app.delete(BASE_URL + "/{}".format(invs[1].id))
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		etag = resp.headers.get("ETag")
+		self._create_invs(1)
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+	def test_etag_of_reused_id(self):
+		"""An Inventory created after a delete never matches the ETags of the deleted one"""
+		invs = self._create_invs(2)
+		url = BASE_URL + "/{}".format(invs[1].id)
+		item_etag = self.app.get(url).headers.get("ETag")
+		list_etag = self.app.get(BASE_URL).headers.get("ETag")
+		self.app.delete(url)
+		new_inv = self._create_invs(1)[0]
+		url = BASE_URL + "/{}".format(new_inv.id)
+		resp = self.app.get(url, headers={"If-None-Match": item_etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": list_etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+	def test_get_inv_list_page_etag(self):
+		"""The ETag of a page matches the fingerprint of that page"""
+		self._create_invs(5)
+		resp = self.app.get(BASE_URL, query_string="limit=2")
+		etag = resp.headers.get("ETag")
+		resp = self.app.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		resp = self.app.get(BASE_URL, query_string="limit=3", headers={"If-None-Match": etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
 	def test_get_inventory_not_found(self):
 		"""Get a Inventory thats not found"""
 		resp = self.app.get(BASE_URL + "/{}".format(0))
@@ -234,6 +340,30 @@ class TestInventoryServer(unittest.TestCase):
 		)
 		self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+	def test_write_statements(self):
+		"""Writes run one statement and serialize without reading the row back"""
+		returning = db.engine.dialect.name == "postgresql"
+		test_inv = InventoryFactory()
+		resp, statements = self._count_statements("post", BASE_URL, json=test_inv.serialize())
+		self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(len(statements), 1)
+		inv_id = resp.get_json()["id"]
+		url = BASE_URL + "/{}".format(inv_id)
+		update = InventoryFactory().serialize()
+		resp, statements = self._count_statements("put", url, json=update)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.get_json()["name"], update["name"])
+		self.assertEqual(len(statements), 1 if returning else 2)
+		resp, statements = self._count_statements("put", url + "/increase", json={"add_stock": 5})
+		self.assertEqual(resp.get_json()["quantity"], update["quantity"] + 5)
+		self.assertEqual(len(statements), 1 if returning else 2)
+		resp, statements = self._count_statements("delete", url)
+		self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertEqual(len(statements), 1)
+		resp, statements = self._count_statements("put", url, json=update)
+		self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+		self.assertEqual(len(statements), 1)
+
 	def test_delete_inventory(self):
 		"""Delete an Inventory"""
 		# create an inventory to update
@@ -310,6 +440,125 @@ class TestInventoryServer(unittest.TestCase):
 		)
 		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 	
+	def test_remove_stock(self):
+		""""Decrease the stock of an existing inventory"""
+		inv = self._create_invs(1)[0]
+		data = {"remove_stock" : inv.quantity}
+		resp = self.app.put(
+			BASE_URL + "/{}/decrease".format(inv.id),
+			json=data,
+			content_type=CONTENT_TYPE_JSON,
+		)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		updated_inv = resp.get_json()
+		self.assertEqual(updated_inv["id"], inv.id)
+		self.assertEqual(updated_inv["quantity"], 0)
+		self.assertEqual(updated_inv["restock_level"], inv.restock_level)
+
+	def test_remove_stock_insufficient(self):
+		""""Decrease the stock by more than there is"""
+		inv = self._create_invs(1)[0]
+		data = {"remove_stock" : inv.quantity + 1}
+		resp = self.app.put(
+			BASE_URL + "/{}/decrease".format(inv.id),
+			json=data,
+			content_type=CONTENT_TYPE_JSON,
+		)
+		self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+		resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+		self.assertEqual(resp.get_json()["quantity"], inv.quantity)
+
+	def test_remove_stock_no_inv(self):
+		""""Decrease the stock of a non-existing inventory"""
+		resp = self.app.put(
+			BASE_URL + "/{}/decrease".format(10),
+			json={"remove_stock" : 1},
+			content_type=CONTENT_TYPE_JSON,
+		)
+		self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_remove_stock_bad_value(self):
+		""""Decrease the stock with a bad value"""
+		inv = self._create_invs(1)[0]
+		resp = self.app.put(
+			BASE_URL + "/{}/decrease".format(inv.id),
+			json={"remove_stock" : -1},
+			content_type=CONTENT_TYPE_JSON,
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_adjust_stock(self):
+		"""Adjust the stock of many Inventory at once"""
+		invs = self._create_invs(3)
+		adjustments = [
+			{"id": invs[0].id, "delta": 5},
+			{"id": invs[1].id, "delta": -invs[1].quantity},
+			{"id": invs[0].id, "delta": 2},
+		]
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json=adjustments, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = {inv["id"]: inv for inv in resp.get_json()}
+		self.assertEqual(len(data), 2)
+		self.assertEqual(data[invs[0].id]["quantity"], invs[0].quantity + 7)
+		self.assertEqual(data[invs[1].id]["quantity"], 0)
+		resp = self.app.get(BASE_URL + "/{}".format(invs[0].id))
+		self.assertEqual(resp.get_json()["quantity"], invs[0].quantity + 7)
+		resp = self.app.get(BASE_URL + "/{}".format(invs[2].id))
+		self.assertEqual(resp.get_json()["quantity"], invs[2].quantity)
+
+	def test_adjust_stock_all_or_nothing(self):
+		"""A batch with one short stock changes nothing"""
+		invs = self._create_invs(2)
+		adjustments = [
+			{"id": invs[0].id, "delta": 5},
+			{"id": invs[1].id, "delta": -(invs[1].quantity + 1)},
+		]
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json=adjustments, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+		resp = self.app.get(BASE_URL + "/{}".format(invs[0].id))
+		self.assertEqual(resp.get_json()["quantity"], invs[0].quantity)
+
+	def test_adjust_stock_not_found(self):
+		"""A batch with an unknown id is rejected"""
+		invs = self._create_invs(1)
+		adjustments = [{"id": invs[0].id, "delta": 5}, {"id": invs[0].id + 100, "delta": 1}]
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json=adjustments, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.get(BASE_URL + "/{}".format(invs[0].id))
+		self.assertEqual(resp.get_json()["quantity"], invs[0].quantity)
+
+	def test_adjust_stock_bad_data(self):
+		"""Adjust the stock with malformed adjustments"""
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json=[{"id": 1}], content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json=[{"id": "1", "delta": 1}], content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.post(
+			BASE_URL + "/adjustments", json={"id": 1, "delta": 1}, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_adjust_stock_booleans(self):
+		"""Adjust the stock with booleans for ids or deltas"""
+		inv = self._create_invs(1)[0]
+		for adjustment in ({"id": True, "delta": 1}, {"id": inv.id, "delta": True}, {"id": inv.id, "delta": False}):
+			resp = self.app.post(
+				BASE_URL + "/adjustments", json=[adjustment], content_type=CONTENT_TYPE_JSON
+			)
+			self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+		self.assertEqual(resp.get_json()["quantity"], inv.quantity)
+
 	def test_query_inv_list_by_name(self):
 		"""Query Inventory by Name"""
 		invs = InventoryFactory.create_batch(4)
@@ -369,6 +618,28 @@ class TestInventoryServer(unittest.TestCase):
 				self.assertEqual(inv["quantity"], invs[1].quantity)
 				self.assertEqual(inv["restock_level"], invs[1].restock_level)
 	
+	def test_query_need_restock_by_shortfall(self):
+		"""Query the Inventory most in need of restock first"""
+		shapes = [(5, 10, Condition.used), (0, 10, Condition.used), (8, 10, Condition.new), (20, 10, Condition.new)]
+		ids = []
+		for quantity, restock_level, condition in shapes:
+			inv = InventoryFactory(quantity=quantity, restock_level=restock_level, condition=condition)
+			inv.create()
+			ids.append(inv.id)
+		resp = self.app.get(BASE_URL, query_string="need_restock=true&sort=shortfall&limit=2")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual([inv["id"] for inv in resp.get_json()], [ids[1], ids[0]])
+		self.assertNotIn("Link", resp.headers)  # the top K have no next page
+		resp = self.app.get(BASE_URL, query_string="need_restock=true&sort=weighted_shortfall")
+		self.assertEqual([inv["id"] for inv in resp.get_json()], [ids[1], ids[0], ids[2]])
+		resp = self.app.get(BASE_URL, query_string="sort=shortfall&stream=true")
+		lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+		self.assertEqual([inv["id"] for inv in lines], [ids[1], ids[0], ids[2], ids[3]])
+		resp = self.app.get(BASE_URL, query_string="sort=shortfall&after_id=1")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.get(BASE_URL, query_string="sort=price")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
 	def test_query_by_condition(self):
 		"""Returns all inv with the condition"""
 		invs = self._create_invs(10)
@@ -385,6 +656,507 @@ class TestInventoryServer(unittest.TestCase):
 			# Check the condition just to be sure
 			self.assertEqual(inv["condition"], test_condition.name)
 	
+	def test_create_inventory_bulk(self):
+		"""Create many Inventory from a JSON array"""
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(4)]
+		records[1]["restock_level"] = -1 # Bad value
+		resp = self.app.post(
+			BASE_URL + "/bulk", json=records, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+		data = resp.get_json()
+		self.assertEqual(len(data["ids"]), 4)
+		self.assertIsNone(data["ids"][1])
+		self.assertEqual([error["index"] for error in data["errors"]], [1])
+		for record, inv_id in zip(records, data["ids"]):
+			if inv_id is None:
+				continue
+			resp = self.app.get(BASE_URL + "/{}".format(inv_id))
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+			self.assertEqual(resp.get_json()["name"], record["name"])
+
+	def test_create_inventory_bulk_null_name(self):
+		"""Create many Inventory where one has no name"""
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(2)]
+		records[1]["name"] = None
+		resp = self.app.post(BASE_URL + "/bulk", json=records, content_type=CONTENT_TYPE_JSON)
+		self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+		data = resp.get_json()
+		self.assertIsNotNone(data["ids"][0])
+		self.assertIsNone(data["ids"][1])
+		self.assertEqual([error["index"] for error in data["errors"]], [1])
+
+	def test_create_inventory_bulk_bad_name(self):
+		"""Create many Inventory where names are not strings"""
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(4)]
+		for record, name in zip(records[1:], [{"x": 1}, 123, ""]):
+			record["name"] = name
+		resp = self.app.post(BASE_URL + "/bulk", json=records, content_type=CONTENT_TYPE_JSON)
+		self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+		data = resp.get_json()
+		self.assertEqual([error["index"] for error in data["errors"]], [1, 2, 3])
+		self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
+	def test_export_inventory_csv(self):
+		"""Export the filtered Inventory as CSV, a few rows at a time"""
+		invs = self._create_invs(7)
+		invs[0].name, invs[0].condition = 'say "hi", all', Condition.new
+		self.app.put(BASE_URL + "/{}".format(invs[0].id), json=invs[0].serialize(), content_type=CONTENT_TYPE_JSON)
+		with patch.dict(app.config, {"EXPORT_CHUNK_SIZE": 2, "STREAM_BATCH_SIZE": 2}):
+			resp = self.app.get(BASE_URL + "/export")
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+			self.assertEqual(resp.mimetype, "text/csv")
+			self.assertIn("filename=inventory.csv", resp.headers["Content-Disposition"])
+			rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+			self.assertEqual([int(row["id"]) for row in rows], sorted(inv.id for inv in invs))
+			self.assertEqual(rows[0]["name"], 'say "hi", all')
+			self.assertEqual(rows[0]["condition"], "new")
+			self.assertEqual(int(rows[0]["quantity"]), invs[0].quantity)
+			resp = self.app.get(BASE_URL + "/export", query_string="condition=new")
+		rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+		self.assertEqual([int(row["id"]) for row in rows],
+			sorted(inv.id for inv in invs if inv.condition == Condition.new))
+
+	def test_export_inventory_ndjson_gzip(self):
+		"""Export the Inventory as gzipped NDJSON"""
+		invs = self._create_invs(3)
+		resp = self.app.get(BASE_URL + "/export", query_string="format=ndjson&gzip=true")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.mimetype, "application/gzip")
+		self.assertIn("filename=inventory.ndjson.gz", resp.headers["Content-Disposition"])
+		lines = gzip.decompress(resp.get_data()).decode().splitlines()
+		self.assertEqual([json.loads(line) for line in lines],
+			sorted((inv.serialize() for inv in invs), key=lambda data: data["id"]))
+		resp = self.app.get(BASE_URL + "/export", query_string="format=xml")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_import_inventory_csv(self):
+		"""Import Inventory from a text/csv body"""
+		inv = self._create_invs(1)[0]
+		body = (
+			"name,condition,quantity,restock_level,id\r\n"
+			"fan,new,10,2,\r\n"
+			"pencil,used,-1,2,\r\n"
+			"speaker,unknown,five,2,\r\n"
+			"renamed,used,3,1,{}\r\n"
+			"noodle,,3,1,\r\n"
+		).format(inv.id)
+		resp = self.app.post(BASE_URL + "/import", data=body.encode(), content_type="text/csv")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["inserted"], 1)
+		self.assertEqual(data["updated"], 1)
+		self.assertEqual(data["rejected"], 3)
+		self.assertEqual([error["line"] for error in data["errors"]], [3, 4, 6])
+		self.assertIn("missing condition", data["errors"][2]["message"])
+		self.assertIn("rows_per_second", data)
+		resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+		self.assertEqual(resp.get_json()["name"], "renamed")
+		resp = self.app.get(BASE_URL, query_string="name=fan")
+		self.assertEqual(len(resp.get_json()), 1)  # the existing Inventory was renamed
+
+	def test_import_inventory_upload(self):
+		"""Import Inventory from a multipart upload"""
+		body = b"\xef\xbb\xbfname,condition,quantity,restock_level\nfan,new,10,2\nfan,used,1,2\n"
+		resp = self.app.post(BASE_URL + "/import", data={"file": (io.BytesIO(body), "catalog.csv")},
+			content_type="multipart/form-data")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.get_json()["inserted"], 2)
+		resp = self.app.post(BASE_URL + "/import", data={}, content_type="multipart/form-data")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_import_inventory_bad_file(self):
+		"""Imports of unreadable files fail as a whole"""
+		resp = self.app.post(BASE_URL + "/import", data="name\n", content_type=CONTENT_TYPE_JSON)
+		self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+		body = b"name,condition,quantity,restock_level\nfan,new,10,2\n\xff\xfe,new,1,1\n"
+		resp = self.app.post(BASE_URL + "/import", data=body, content_type="text/csv")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.get(BASE_URL)
+		self.assertEqual(resp.get_json(), [])
+
+	def test_import_inventory_command(self):
+		"""Import Inventory with the flask CLI"""
+		with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+			file.write("name,condition,quantity,restock_level\nfan,new,10,2\nfan,new,x,2\n")
+		try:
+			result = app.test_cli_runner().invoke(args=["import-inventory", file.name])
+		finally:
+			os.remove(file.name)
+		self.assertEqual(result.exit_code, 0, result.output)
+		self.assertIn("Inserted 1, updated 0, rejected 1", result.output)
+		self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
+	def test_create_inventory_bulk_ndjson(self):
+		"""Create many Inventory from an NDJSON body"""
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(3)]
+		lines = [json.dumps(record) for record in records]
+		lines.insert(1, "{not json")
+		resp = self.app.post(
+			BASE_URL + "/bulk", data="\n".join(lines) + "\n", content_type=CONTENT_TYPE_NDJSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+		data = resp.get_json()
+		self.assertEqual(len(data["ids"]), 4)
+		self.assertIsNone(data["ids"][1])
+		self.assertEqual([error["index"] for error in data["errors"]], [1])
+		resp = self.app.get(BASE_URL)
+		self.assertEqual(len(resp.get_json()), 3)
+
+	def test_create_inventory_bulk_not_a_list(self):
+		"""Create many Inventory with a payload that is not an array"""
+		resp = self.app.post(
+			BASE_URL + "/bulk", json={"name": "paper"}, content_type=CONTENT_TYPE_JSON
+		)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_update_inventory_bulk(self):
+		"""Update many Inventory by id in one request"""
+		invs = self._create_invs(3)
+		ids = [inv.id for inv in invs]
+		self.app.get(BASE_URL + "/{}".format(ids[0]))  # cached before the update
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(6)]
+		for record, inv_id in zip(records, [ids[0], 0, ids[1], ids[2], ids[2], None]):
+			record["id"] = inv_id
+		records[3]["quantity"] = -1  # Bad value
+		del records[5]["id"]
+		with patch.dict(app.config, {"BULK_CHUNK_SIZE": 2}):
+			resp, statements = self._count_statements("put", BASE_URL, json=records)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["updated"], 3)
+		self.assertEqual(data["missing"], [0])
+		self.assertEqual([error["index"] for error in data["errors"]], [3, 5])
+		if db.engine.dialect.name == "postgresql":
+			self.assertEqual(len(statements), 2)  # one UPDATE per chunk
+		for index in (0, 2, 4):
+			resp = self.app.get(BASE_URL + "/{}".format(records[index]["id"]))
+			self.assertEqual(resp.get_json(), records[index])
+
+	def test_update_inventory_bulk_duplicate_id(self):
+		"""Update the same Inventory twice in one request"""
+		inv = self._create_invs(1)[0]
+		records = [inv.serialize(), inv.serialize()]
+		resp = self.app.put(BASE_URL, json=records)
+		data = resp.get_json()
+		self.assertEqual(data["updated"], 1)
+		self.assertEqual([error["index"] for error in data["errors"]], [1])
+		resp = self.app.put(BASE_URL, json={"id": inv.id})
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_update_inventory_bulk_bad_values(self):
+		"""Update many Inventory where some values cannot be stored"""
+		invs = self._create_invs(4)
+		records = [inv.serialize() for inv in invs]
+		records[1]["name"] = None
+		records[2]["quantity"] = 2 ** 40
+		records[3]["restock_level"] = 2 ** 31
+		resp = self.app.put(BASE_URL, json=records)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["updated"], 1)
+		self.assertEqual([error["index"] for error in data["errors"]], [1, 2, 3])
+		for inv in invs:
+			resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+			self.assertEqual(resp.get_json(), inv.serialize())
+
+	def test_update_inventory_bulk_mixed_types(self):
+		"""Update many Inventory named by numbers and strings in one request"""
+		invs = self._create_invs(3)
+		records = [inv.serialize() for inv in invs]
+		for record, name in zip(records, [123, "paper", 4.5]):
+			record["name"] = name
+		resp = self.app.put(BASE_URL, json=records)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["updated"], 1)
+		self.assertEqual([error["index"] for error in data["errors"]], [0, 2])
+		for inv, name in zip(invs, [invs[0].name, "paper", invs[2].name]):
+			resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+			self.assertEqual(resp.get_json()["name"], name)
+
+	def test_get_inv_list_paginated(self):
+		"""Walk the Inventory list one page at a time"""
+		invs = self._create_invs(5)
+		resp = self.app.get(BASE_URL, query_string="limit=2")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		seen = []
+		while True:
+			data = resp.get_json()
+			self.assertLessEqual(len(data), 2)
+			seen.extend(inv["id"] for inv in data)
+			link = resp.headers.get("Link")
+			if link is None:
+				break
+			self.assertTrue(link.endswith('; rel="next"'))
+			resp = self.app.get(link[1:link.index(">")])
+			self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(seen, sorted(inv.id for inv in invs))
+
+	def test_get_inv_list_after_id(self):
+		"""List the Inventory after a given id"""
+		invs = self._create_invs(4)
+		ids = sorted(inv.id for inv in invs)
+		resp = self.app.get(BASE_URL, query_string="after_id={}".format(ids[1]))
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual([inv["id"] for inv in resp.get_json()], ids[2:])
+		self.assertIsNone(resp.headers.get("Link"))
+
+	def test_query_inv_list_paginated_by_name(self):
+		"""Pagination keeps the name filter"""
+		invs = InventoryFactory.create_batch(6)
+		for inv in invs[:4]:
+			inv.name = "DevOps"
+		for inv in invs:
+			inv.create()
+		resp = self.app.get(BASE_URL, query_string="name=DevOps&limit=3")
+		self.assertEqual(len(resp.get_json()), 3)
+		link = resp.headers.get("Link")
+		self.assertIn("name=DevOps", link)
+		resp = self.app.get(link[1:link.index(">")])
+		data = resp.get_json()
+		self.assertEqual(len(data), 1)
+		self.assertEqual(data[0]["name"], "DevOps")
+		self.assertIsNone(resp.headers.get("Link"))
+
+	def test_get_inv_list_bad_cursor(self):
+		"""List Inventory with a cursor that was not issued by the service"""
+		resp = self.app.get(BASE_URL, query_string="cursor=garbage")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_get_inv_list_bad_limit(self):
+		"""List Inventory with a limit out of range"""
+		resp = self.app.get(BASE_URL, query_string="limit=0")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_stream_inv_list(self):
+		"""Stream the Inventory list as NDJSON"""
+		invs = self._create_invs(5)
+		resp = self.app.get(BASE_URL, headers={"Accept": CONTENT_TYPE_NDJSON})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.mimetype, CONTENT_TYPE_NDJSON)
+		data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+		self.assertEqual([inv["id"] for inv in data], sorted(inv.id for inv in invs))
+		for inv in data:
+			self.assertEqual(set(inv.keys()), {"id", "name", "condition", "quantity", "restock_level"})
+
+	def test_stream_inv_list_with_filter(self):
+		"""Stream the Inventory list with a query string flag and a filter"""
+		invs = InventoryFactory.create_batch(4)
+		invs[0].name = "DevOps"
+		invs[1].name = "DevOps"
+		for inv in invs:
+			inv.create()
+		resp = self.app.get(BASE_URL, query_string="stream=true&name=DevOps")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		lines = resp.get_data(as_text=True).splitlines()
+		self.assertEqual(len(lines), 2)
+		for line in lines:
+			self.assertEqual(json.loads(line)["name"], "DevOps")
+
+	def test_query_combined_filters(self):
+		"""Query Inventory with several filters at once"""
+		invs = InventoryFactory.create_batch(6)
+		for i, inv in enumerate(invs):
+			inv.name = "DevOps" if i < 4 else "Agile"
+			inv.condition = Condition.new if i % 2 else Condition.used
+			inv.quantity = i * 10
+			inv.create()
+		resp = self.app.get(
+			BASE_URL, query_string="name=DevOps&condition=new&quantity_min=15&quantity_max=30"
+		)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual([inv["quantity"] for inv in data], [30])
+		resp = self.app.get(BASE_URL, query_string="name=&condition=new")
+		self.assertEqual(len(resp.get_json()), 3)  # an empty name is no filter
+
+	def test_delete_inventory_by_filters(self):
+		"""Delete the Inventory matching filters with one request"""
+		invs = InventoryFactory.create_batch(6)
+		for i, inv in enumerate(invs):
+			inv.name = "DevOps" if i < 4 else "Agile"
+			inv.quantity = i * 10
+			inv.create()
+		ids = [inv.id for inv in invs]
+		db.session.expunge_all()  # a request would not share the objects of the test
+		resp = self.app.delete(BASE_URL, query_string="name=DevOps&quantity_min=15")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.get_json(), {"deleted": 2})
+		resp = self.app.delete(BASE_URL, query_string="id_min={0}&id_max={0}".format(ids[4]))
+		self.assertEqual(resp.get_json(), {"deleted": 1})
+		remaining = sorted(inv["id"] for inv in self.app.get(BASE_URL).get_json())
+		self.assertEqual(remaining, [ids[0], ids[1], ids[5]])
+		# the cache does not serve deleted Inventory
+		resp = self.app.get(BASE_URL + "/{}".format(ids[2]))
+		self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_delete_inventory_needs_filter(self):
+		"""Delete every Inventory only with all=true"""
+		self._create_invs(3)
+		resp = self.app.delete(BASE_URL)
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.delete(BASE_URL, query_string="need_restock=false")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		resp = self.app.delete(BASE_URL, query_string="name=")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(len(self.app.get(BASE_URL).get_json()), 3)
+		resp = self.app.delete(BASE_URL, query_string="all=true")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(resp.get_json(), {"deleted": 3})
+		self.assertEqual(self.app.get(BASE_URL).get_json(), [])
+
+	def test_reset_inventory(self):
+		"""Truncate and reseed the Inventory when it is allowed"""
+		self._create_invs(3)
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(2)]
+		resp = self.app.post("/api/internal/reset", json=records)
+		self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+		with patch.dict(app.config, {"ALLOW_RESET": True}):
+			resp = self.app.post("/api/internal/reset", json=records)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["errors"], [])
+		listed = self.app.get(BASE_URL).get_json()
+		self.assertEqual(sorted(inv["id"] for inv in listed), sorted(data["ids"]))
+		with patch.dict(app.config, {"ALLOW_RESET": True}):
+			resp = self.app.post("/api/internal/reset")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(self.app.get(BASE_URL).get_json(), [])
+
+	def test_reset_inventory_etags(self):
+		"""ETags taken before a reset never match the reseeded Inventory"""
+		records = [inv.serialize() for inv in InventoryFactory.build_batch(2)]
+		with patch.dict(app.config, {"ALLOW_RESET": True}):
+			ids = self.app.post("/api/internal/reset", json=records).get_json()["ids"]
+			url = BASE_URL + "/{}".format(ids[0])
+			item_etag = self.app.get(url).headers.get("ETag")
+			list_etag = self.app.get(BASE_URL).headers.get("ETag")
+			self.app.post("/api/internal/reset", json=records)
+		for inv_id in range(1, max(ids) + 3):
+			resp = self.app.get(BASE_URL + "/{}".format(inv_id), headers={"If-None-Match": item_etag})
+			self.assertNotEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+		resp = self.app.get(BASE_URL, headers={"If-None-Match": list_etag})
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertNotIn(ids[0], [inv["id"] for inv in resp.get_json()])
+
+	def test_query_bad_condition(self):
+		"""Query Inventory by a condition that does not exist"""
+		resp = self.app.get(BASE_URL, query_string="condition=broken")
+		self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_get_inv_stats(self):
+		"""Get the statistics of the Inventory"""
+		invs = InventoryFactory.create_batch(5)
+		for i, inv in enumerate(invs):
+			inv.name = "DevOps" if i < 3 else "Agile"
+			inv.condition = Condition.new if i % 2 else Condition.used
+			inv.quantity = i * 10
+			inv.restock_level = 25
+			inv.create()
+		resp = self.app.get(BASE_URL + "/stats")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["skus"], 5)
+		self.assertEqual(data["units"], 100)
+		self.assertEqual(data["by_condition"]["new"], {"skus": 2, "units": 40})
+		self.assertEqual(data["by_condition"]["used"], {"skus": 3, "units": 60})
+		self.assertEqual(data["by_condition"]["unknown"], {"skus": 0, "units": 0})
+		self.assertEqual(data["need_restock"], {"skus": 3, "shortfall": 25 + 15 + 5})
+		resp = self.app.get(BASE_URL + "/stats", query_string="name=DevOps&condition=new")
+		data = resp.get_json()
+		self.assertEqual(data["skus"], 1)
+		self.assertEqual(data["units"], 10)
+		self.assertEqual(data["need_restock"], {"skus": 1, "shortfall": 15})
+
+	def test_get_inv_stats_empty(self):
+		"""Get the statistics of an empty Inventory"""
+		resp = self.app.get(BASE_URL + "/stats")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertEqual(data["skus"], 0)
+		self.assertEqual(data["need_restock"], {"skus": 0, "shortfall": 0})
+
+	def test_get_pool_stats(self):
+		"""Get the connection pool telemetry"""
+		self._create_invs(1)
+		resp = self.app.get("/api/internal/pool")
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		data = resp.get_json()
+		self.assertGreater(data["checkouts"], 0)
+		self.assertGreater(data["checkout_wait"]["count"] + data["checkins"], 0)
+		if data["pool"] == "InstrumentedQueuePool":
+			self.assertIn("checked_out", data)
+			self.assertIn("overflow", data)
+
+	def test_get_metrics(self):
+		"""Requests are counted and timed by resource with their SQL statements"""
+		labels = {"resource": "InvCollection", "method": "GET"}
+		sample = lambda name, **extra: REGISTRY.get_sample_value(name, dict(labels, **extra)) or 0
+		app.extensions["metrics"].flush()
+		requests = sample("inventory_http_request_duration_seconds_count", status="200")
+		statements = sample("inventory_db_statements_per_request_bucket", le="1.0")
+		self._create_invs(2)
+		resp = self.app.get(BASE_URL)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertEqual(sample("inventory_http_request_duration_seconds_count", status="200"), requests + 1)
+		resp = self.app.get("/metrics")  # writes the pending SQL histograms
+		self.assertEqual(sample("inventory_db_statements_per_request_bucket", le="1.0"), statements + 1)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertTrue(resp.content_type.startswith("text/plain"))
+		body = resp.get_data(as_text=True)
+		self.assertIn('inventory_http_request_duration_seconds_bucket{le="0.001",method="GET",resource="InvCollection",status="200"}', body)
+		self.assertIn('inventory_db_duration_seconds_count{method="POST",resource="InvCollection"}', body)
+		self.assertIn('inventory_cache_events{event="hits"}', body)
+		self.assertIn('inventory_db_pool_events{event="checkouts"}', body)
+
+	def test_pending_histogram(self):
+		"""Observations written at flush end in the buckets observe() would use"""
+		registry = CollectorRegistry()
+		observed = Histogram("observed", "", buckets=(0, 1, 2, 5), registry=registry)
+		flushed = Histogram("flushed", "", buckets=(0, 1, 2, 5), registry=registry)
+		pending = metrics.PendingHistogram(flushed)
+		for amount in (0, 1, 1, 1.5, 2, 4, 5, 9):
+			observed.observe(amount)
+			pending.observe(amount)
+		self.assertEqual(registry.get_sample_value("flushed_count"), 0)
+		pending.flush()
+		for bucket in ("0.0", "1.0", "2.0", "5.0", "+Inf"):
+			self.assertEqual(registry.get_sample_value("flushed_bucket", {"le": bucket}),
+				registry.get_sample_value("observed_bucket", {"le": bucket}))
+		self.assertEqual(registry.get_sample_value("flushed_sum"), 23.5)
+
+	def test_query_budget_exceeded(self):
+		"""A request over its statement budget fails in testing and warns otherwise"""
+		inv = self._create_invs(1)[0]
+		with patch.object(routes.InvResource.get, "query_budget", 0):
+			with self.assertRaises(QueryBudgetExceeded):
+				self.app.get(BASE_URL + "/{}".format(inv.id))
+			Inventory.cache.clear()
+			app.config["TESTING"] = False
+			logging.disable(logging.NOTSET)
+			try:
+				with self.assertLogs("flask.app", logging.WARNING) as logs:
+					resp = self.app.get(BASE_URL + "/{}".format(inv.id))
+			finally:
+				app.config["TESTING"] = True
+				logging.disable(logging.CRITICAL)
+		self.assertEqual(resp.status_code, status.HTTP_200_OK)
+		self.assertIn("ran 1 SQL statements, its budget is 0", "\n".join(logs.output))
+
+	def test_slow_query_log(self):
+		"""Statements over the threshold are logged with their route"""
+		self._create_invs(1)
+		logging.disable(logging.NOTSET)
+		try:
+			with patch.object(metrics, "slow_query_seconds", 0.0):
+				with self.assertLogs("flask.app", logging.WARNING) as logs:
+					self.app.get(BASE_URL + "/stats")
+		finally:
+			logging.disable(logging.CRITICAL)
+		self.assertIn("Slow query", logs.output[0])
+		self.assertIn("from GET /api/inventory/stats", logs.output[0])
+
 	def test_invalid_method(self):
 		"""Invalid method should return 405"""
 		resp = self.app.get(